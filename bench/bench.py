@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+# benchmarks rfap-pycli's command paths against the in-process fake server
+# from fake_server.py, reporting ops/s, MiB/s and peak RSS per scenario; every
+# scenario runs in a forked child so that its peak RSS is its own
+
+from contextlib import redirect_stdout
+import argparse
+import importlib.util
+import io
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+
+import fake_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_app(server: fake_server.FakeServer, workers: int):
+    fake_server.install(server)
+    spec = importlib.util.spec_from_file_location("rfap_pycli", os.path.join(ROOT, "rfap-pycli.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    os.environ["RFAP_PYCLI_CONFIG"] = os.devnull
+    sys.argv = ["rfap-pycli", "-f", os.devnull, "-y"]
+    module.RfapCliApp.settings |= {"Workers": workers, "CacheTTL": 0, "Progress": False, "ContentCacheSize": 0}
+    return module.RfapCliApp()
+
+def peak_rss_mib() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+# run `command args` count times, returns (seconds, failed runs)
+def run(app, command: str, *args, count: int = 1) -> tuple:
+    failed = 0
+    start = time.monotonic()
+    with redirect_stdout(io.StringIO()):
+        for _ in range(count):
+            app.cmd, app.args = command, tuple(args)
+            if not app.execute():
+                failed += 1
+    return time.monotonic() - start, failed
+
+def report(name: str, seconds: float, ops: int, size: int, failed: int) -> None:
+    rate = size / seconds / 1024 / 1024 if seconds > 0 else 0
+    ops_rate = ops / seconds if seconds > 0 else 0
+    status = "" if failed == 0 else f"  ({failed} failed)"
+    print(f"{name:32} {seconds:9.3f}s {ops_rate:10.1f} ops/s {rate:9.2f} MiB/s {peak_rss_mib():9.1f} MiB RSS{status}",
+          flush=True)
+
+def bench_ls(app, server, args) -> None:
+    server.add_directory("/ls")
+    for i in range(args.entries):
+        server.add_file(f"/ls/file{i}.txt", b"")
+    app.settings["ColoredLS"] = False
+    seconds, failed = run(app, "ls", "/ls", count=args.repeat)
+    report(f"ls {args.entries} entries", seconds, args.repeat, 0, failed)
+    app.settings["ColoredLS"] = True
+    seconds, failed = run(app, "ls", "/ls", count=args.repeat)
+    report(f"colored ls {args.entries} entries", seconds, args.repeat, 0, failed)
+    app.settings["ColoredLS"] = False
+
+def bench_cat(app, server, args) -> None:
+    server.add_file("/cat.txt", b"0123456789abcdef" * (1024 * 1024 // 16))
+    seconds, failed = run(app, "cat", "/cat.txt", count=args.repeat)
+    report("cat 1 MiB", seconds, args.repeat, args.repeat * 1024 * 1024, failed)
+    app.settings["ContentCacheSize"] = 16 * 1024 * 1024
+    seconds, failed = run(app, "cat", "/cat.txt", count=args.repeat)
+    report("cat 1 MiB (content cache)", seconds, args.repeat, args.repeat * 1024 * 1024, failed)
+    app.settings["ContentCacheSize"] = 0
+
+def bench_transfer(app, server, args) -> None:
+    for size in args.sizes:
+        content = os.urandom(1024 * 1024) * size
+        server.add_file(f"/save{size}", content)
+        local = os.path.join(args.tempdir, f"save{size}")
+        seconds, failed = run(app, "save", f"/save{size}", local)
+        report(f"save {size} MiB", seconds, 1, len(content), failed)
+        del content
+        server.entries[f"/save{size}"] = b""
+        seconds, failed = run(app, "upload", local, f"/upload{size}")
+        report(f"upload {size} MiB", seconds, 1, size * 1024 * 1024, failed)
+        server.entries[f"/upload{size}"] = b""
+        os.remove(local)
+
+def bench_tree(app, server, args) -> None:
+    count = server.add_tree("/tree", args.depth, args.fanout, args.files, 1024)
+    for command in ("find", "du"):
+        app.cache.clear()
+        seconds, failed = run(app, command, "/tree")
+        report(f"{command} tree ({count} files)", seconds, count, 0, failed)
+    local = os.path.join(args.tempdir, "tree")
+    seconds, failed = run(app, "mget", "/tree", local)
+    report(f"mget tree ({count} files)", seconds, count, count * 1024, failed)
+    seconds, failed = run(app, "mput", local, "/tree-upload")
+    report(f"mput tree ({count} files)", seconds, count, count * 1024, failed)
+    shutil.rmtree(local)
+
+SCENARIOS = {
+    "ls": bench_ls,
+    "cat": bench_cat,
+    "transfer": bench_transfer,
+    "tree": bench_tree
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark rfap-pycli against an in-process fake server")
+    parser.add_argument("scenarios", nargs="*", help=f"scenarios to run (default all of {', '.join(SCENARIOS)})")
+    parser.add_argument("--latency", type=float, default=1.0, help="per-request latency in ms (default 1)")
+    parser.add_argument("--bandwidth", type=float, default=0, help="per-connection bandwidth in MiB/s (default unlimited)")
+    parser.add_argument("--workers", type=int, default=8, help="connections used by the client (default 8)")
+    parser.add_argument("--entries", type=int, default=5000, help="entries of the ls directory (default 5000)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 16, 64], help="save/upload sizes in MiB")
+    parser.add_argument("--depth", type=int, default=3, help="depth of the mget/mput tree (default 3)")
+    parser.add_argument("--fanout", type=int, default=4, help="folders per folder of the tree (default 4)")
+    parser.add_argument("--files", type=int, default=10, help="files per folder of the tree (default 10)")
+    parser.add_argument("--repeat", type=int, default=10, help="repetitions of ls and cat (default 10)")
+    args = parser.parse_args()
+    if (unknown := set(args.scenarios) - set(SCENARIOS)):
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    server = fake_server.FakeServer(args.latency / 1000, args.bandwidth * 1024 * 1024 or None)
+    print(f"latency {args.latency} ms, bandwidth {args.bandwidth or 'unlimited'} MiB/s, {args.workers} workers")
+    failed = 0
+    with tempfile.TemporaryDirectory(prefix="rfap-bench-") as args.tempdir:
+        os.environ["XDG_CACHE_HOME"] = os.path.join(args.tempdir, "cache")
+        for name in args.scenarios or SCENARIOS:
+            if (pid := os.fork()) == 0:
+                os._exit(run_scenario(name, server, args))
+            failed += os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1]) != 0
+    if failed > 0:
+        sys.exit(f"{failed} scenarios crashed")
+
+# body of a scenario's child process, returns its exit code
+def run_scenario(name: str, server: fake_server.FakeServer, args) -> int:
+    try:
+        app = load_app(server, args.workers)
+        try:
+            SCENARIOS[name](app, server, args)
+        finally:
+            app.disconnect()
+        print(f"{name}: {server.requests} requests served", flush=True)
+        return 0
+    except BaseException:
+        traceback.print_exc()
+        return 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+# in-process stand-in for an rfap server, exposed through a fake librfap module
+# with the same Client API as librfap 0.3.0, so that rfap-pycli can be
+# benchmarked offline; every request is delayed by the configured latency and,
+# for payloads, by size / bandwidth of the connection
+
+import mimetypes
+import sys
+import threading
+import time
+import types
+
+class FakeServer:
+    def __init__(self, latency: float = 0.0, bandwidth: float = None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.entries = {"/": None}
+        self.modified = {"/": time.time()}
+        self.listings = {"/": set()}
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def normpath(self, path: str) -> str:
+        return "/" + "/".join(part for part in path.split("/") if part not in ("", "."))
+
+    def parent(self, path: str) -> str:
+        return self.normpath("/".join(path.split("/")[:-1]))
+
+    def delay(self, size: int = 0) -> None:
+        with self.lock:
+            self.requests += 1
+        seconds = self.latency
+        if self.bandwidth:
+            seconds += size / self.bandwidth
+        if seconds > 0:
+            time.sleep(seconds)
+
+    # the following methods expect normalized paths and self.lock to be held
+    def put(self, path: str, content) -> None:
+        if path not in self.entries and path != "/":
+            self.listings[self.parent(path)].add(path.split("/")[-1])
+        if content is None:
+            self.listings.setdefault(path, set())
+        self.entries[path] = content
+        self.modified[path] = time.time()
+
+    def remove(self, path: str) -> None:
+        for child in self.children(path):
+            self.remove(child)
+        del self.entries[path]
+        del self.modified[path]
+        self.listings.pop(path, None)
+        self.listings[self.parent(path)].discard(path.split("/")[-1])
+
+    def children(self, path: str) -> list:
+        prefix = path.rstrip("/") + "/"
+        return [prefix + name for name in self.listings.get(path, ())]
+
+    def add_directory(self, path: str) -> None:
+        with self.lock:
+            self.put(self.normpath(path), None)
+
+    def add_file(self, path: str, content: bytes) -> None:
+        with self.lock:
+            self.put(self.normpath(path), content)
+
+    # build a tree of `depth` levels with `fanout` folders and `files` files of `size` bytes per folder
+    def add_tree(self, root: str, depth: int, fanout: int, files: int, size: int) -> int:
+        self.add_directory(root)
+        count = 0
+        for i in range(files):
+            self.add_file(f"{root}/file{i}", b"x" * size)
+            count += 1
+        if depth > 0:
+            for i in range(fanout):
+                count += self.add_tree(f"{root}/dir{i}", depth - 1, fanout, files, size)
+        return count
+
+    def metadata(self, path: str, **extra) -> dict:
+        metadata = {"ErrorCode": 0, "ErrorMessage": "", "Path": path}
+        metadata.update(extra)
+        return metadata
+
+    def error(self, path: str, message: str) -> dict:
+        return {"ErrorCode": 1, "ErrorMessage": message, "Path": path}
+
+    def info(self, path: str) -> dict:
+        if path not in self.entries:
+            return self.error(path, "file or directory does not exist")
+        content = self.entries[path]
+        if content is None:
+            return self.metadata(path, Type="d", Size=0, Modified=self.modified[path], FileType="directory")
+        file_type = mimetypes.guess_type(path)[0] or "text/plain"
+        return self.metadata(path, Type="f", Size=len(content), Modified=self.modified[path], FileType=file_type)
+
+# mirrors librfap.Client of librfap 0.3.0
+class Client:
+    server = None
+
+    def __init__(self, server: str, port: int = 6700):
+        self.address = (server, port)
+        self.server.delay()
+
+    def rfap_ping(self):
+        self.server.delay()
+
+    def rfap_disconnect(self):
+        self.server.delay()
+
+    def rfap_info(self, path: str) -> dict:
+        self.server.delay()
+        path = self.server.normpath(path)
+        with self.server.lock:
+            return self.server.info(path)
+
+    def rfap_directory_read(self, path: str) -> tuple:
+        path = self.server.normpath(path)
+        with self.server.lock:
+            if self.server.entries.get(path, b"") is not None:
+                files = None
+            else:
+                files = sorted(self.server.listings[path])
+        self.server.delay(0 if files is None else sum(len(f) + 1 for f in files))
+        if files is None:
+            return self.server.error(path, "not a directory"), []
+        return self.server.metadata(path), files
+
+    def rfap_file_read(self, path: str) -> tuple:
+        path = self.server.normpath(path)
+        with self.server.lock:
+            content = self.server.entries.get(path)
+            metadata = self.server.info(path)
+        if content is None:
+            self.server.delay()
+            return self.server.error(path, "not a file"), b""
+        self.server.delay(len(content))
+        return metadata, content
+
+    def rfap_file_write(self, path: str, content: bytes) -> dict:
+        self.server.delay(len(content))
+        path = self.server.normpath(path)
+        with self.server.lock:
+            if self.server.entries.get(self.server.parent(path), b"") is not None:
+                return self.server.error(path, "parent directory does not exist")
+            self.server.put(path, bytes(content))
+        return self.server.metadata(path)
+
+    def rfap_file_create(self, path: str) -> dict:
+        return self.rfap_file_write(path, b"")
+
+    def rfap_file_delete(self, path: str) -> dict:
+        self.server.delay()
+        path = self.server.normpath(path)
+        with self.server.lock:
+            if self.server.entries.get(path) is None:
+                return self.server.error(path, "not a file")
+            self.server.remove(path)
+        return self.server.metadata(path)
+
+    def rfap_file_copy(self, source: str, destin: str) -> dict:
+        self.server.delay()
+        source, destin = self.server.normpath(source), self.server.normpath(destin)
+        with self.server.lock:
+            if self.server.entries.get(source) is None:
+                return self.server.error(source, "not a file")
+            if self.server.entries.get(self.server.parent(destin), b"") is not None:
+                return self.server.error(destin, "parent directory does not exist")
+            self.server.put(destin, self.server.entries[source])
+        return self.server.metadata(destin)
+
+    def rfap_file_move(self, source: str, destin: str) -> dict:
+        metadata = self.rfap_file_copy(source, destin)
+        if metadata["ErrorCode"] == 0:
+            with self.server.lock:
+                self.server.remove(self.server.normpath(source))
+        return metadata
+
+    def rfap_directory_create(self, path: str) -> dict:
+        self.server.delay()
+        path = self.server.normpath(path)
+        with self.server.lock:
+            if path in self.server.entries:
+                return self.server.error(path, "already exists")
+            if self.server.entries.get(self.server.parent(path), b"") is not None:
+                return self.server.error(path, "parent directory does not exist")
+            self.server.put(path, None)
+        return self.server.metadata(path)
+
+    def rfap_directory_delete(self, path: str) -> dict:
+        self.server.delay()
+        path = self.server.normpath(path)
+        with self.server.lock:
+            if self.server.entries.get(path, b"") is not None or path == "/":
+                return self.server.error(path, "not a directory")
+            self.server.remove(path)
+        return self.server.metadata(path)
+
+    def rfap_directory_copy(self, source: str, destin: str) -> dict:
+        self.server.delay()
+        source, destin = self.server.normpath(source), self.server.normpath(destin)
+        with self.server.lock:
+            if self.server.entries.get(source, b"") is not None:
+                return self.server.error(source, "not a directory")
+            self.copy_tree(source, destin)
+        return self.server.metadata(destin)
+
+    def copy_tree(self, source: str, destin: str) -> None:
+        self.server.put(destin, self.server.entries[source])
+        for child in self.server.children(source):
+            self.copy_tree(child, destin + child[len(source):])
+
+    def rfap_directory_move(self, source: str, destin: str) -> dict:
+        metadata = self.rfap_directory_copy(source, destin)
+        if metadata["ErrorCode"] != 0:
+            return metadata
+        return self.rfap_directory_delete(source)
+
+# register a fake librfap module backed by server, must run before rfap-pycli is loaded
+def install(server: FakeServer) -> types.ModuleType:
+    module = types.ModuleType("librfap")
+    module.__version__ = "0.3.0"
+    module.Client = type("Client", (Client,), {"server": server})
+    sys.modules["librfap"] = module
+    return module
@@ -1,16 +1,816 @@
 #!/usr/bin/env python3
 
-from platform import platform
-import colorama
+from bisect import bisect_left, insort
+from collections import OrderedDict, deque
+from stat import S_ISDIR
+import builtins
+import codecs
+import contextlib
+import copy
+import fnmatch
 import getopt
-import librfap
+import glob
+import gzip
+import hashlib
+import importlib
+import importlib.util
+import io
+import json
+import mmap
 import os
-import pprint
+import random
+import re
+import shutil
+import socket
+import struct
 import sys
 import tempfile
 import threading
 import time
-import yaml
+
+# imports a module on first use, so that startup only pays for the modules the session actually needs
+class LazyModule:
+    def __init__(self, name: str):
+        self.name = name
+        self.module = None
+        self.found = None
+
+    # whether an optional module is installed, looked up on the first call
+    def available(self) -> bool:
+        if self.found is None:
+            self.found = importlib.util.find_spec(self.name) is not None
+        return self.found
+
+    def __getattr__(self, attribute: str):
+        if self.module is None:
+            self.module = importlib.import_module(self.name)
+        return getattr(self.module, attribute)
+
+asyncio = LazyModule("asyncio")
+colorama = LazyModule("colorama")
+futures = LazyModule("concurrent.futures")
+librfap = LazyModule("librfap")
+platform = LazyModule("platform")
+pprint = LazyModule("pprint")
+yaml = LazyModule("yaml")
+readline = LazyModule("readline")
+
+# librfap.Client that survives connection drops: a request failing with a connection error closes the
+# connection, the next request reconnects with exponential backoff and jitter, and idempotent requests
+# are replayed on the new connection; rfap_file_write counts as idempotent as it always replaces the whole file.
+# Other requests are not replayed, so a connection that has been idle for a while is pinged before them
+class Connection:
+    IDEMPOTENT_REQUESTS = ("rfap_ping", "rfap_info", "rfap_directory_read", "rfap_file_read", "rfap_file_write")
+    MAX_RETRY_DELAY = 30
+    IDLE_CHECK = 5
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.client = None
+        self.last_used = 0.0
+
+    def backoff(self, attempt: int) -> None:
+        delay = min(self.MAX_RETRY_DELAY, self.engine.retry_delay * 2 ** attempt)
+        time.sleep(random.uniform(delay / 2, delay))
+
+    def connect(self) -> None:
+        try:
+            self.client = librfap.Client(self.engine.server, port=self.engine.port)
+        except OSError as e:
+            self.engine.record_failure(e)
+            raise
+
+    def drop(self) -> None:
+        if self.client is None:
+            return
+        try:
+            self.client.rfap_disconnect()
+        except (OSError, EOFError):
+            pass
+        self.client = None
+
+    # requests that fail while reconnecting were never sent, so they are retried whether idempotent or not;
+    # once the retries are used up the error is raised as a ConnectionError, which callers tell apart
+    # from errors of local files
+    def call(self, name: str, *args, retries: int = None):
+        retries = self.engine.retries if retries is None else retries
+        if name not in self.IDEMPOTENT_REQUESTS and self.client is not None \
+                and time.monotonic() - self.last_used > self.IDLE_CHECK:
+            self.call("rfap_ping", retries=retries)
+        attempt = 0
+        while True:
+            sent = False
+            try:
+                if self.client is None:
+                    self.connect()
+                sent = True
+                result = getattr(self.client, name)(*args)
+                self.last_used = time.monotonic()
+                self.engine.record_success()
+                return result
+            except (OSError, EOFError) as e:
+                if sent:
+                    self.drop()
+                    self.engine.record_failure(e)
+                if (sent and name not in self.IDEMPOTENT_REQUESTS) or attempt >= retries:
+                    if isinstance(e, ConnectionError):
+                        raise
+                    raise ConnectionError(str(e) or type(e).__name__) from e
+            self.backoff(attempt)
+            attempt += 1
+            self.engine.record_reconnect()
+
+    def __getattr__(self, name: str):
+        if not name.startswith("rfap_"):
+            raise AttributeError(name)
+        return lambda *args: self.call(name, *args)
+
+    def rfap_disconnect(self) -> None:
+        self.drop()
+
+# runs librfap requests from an asyncio event loop in a background thread, spread over up to
+# `size` connections, so that independent requests overlap instead of waiting for each other;
+# idle connections are pinged from the same loop to keep them alive
+class Engine:
+    KEEP_ALIVE_INTERVAL = 60
+    KEEP_ALIVE_CHECK = 5
+
+    def __init__(self, server: str, port: int, size: int, retries: int = 0, retry_delay: float = 0.5):
+        self.server = server
+        self.port = port
+        self.size = max(1, size)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.connections = []
+        self.last_used = {}
+        self.health = {"Healthy": True, "Failures": 0, "Reconnects": 0, "LastError": None, "LastErrorTime": None}
+        self.health_lock = threading.Lock()
+        self.loop = asyncio.new_event_loop()
+        self.executor = futures.ThreadPoolExecutor(max_workers=self.size)
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    def record_success(self) -> None:
+        self.health["Healthy"] = True
+
+    def record_failure(self, error: Exception) -> None:
+        with self.health_lock:
+            self.health |= {"Healthy": False, "Failures": self.health["Failures"] + 1,
+                            "LastError": f"{type(error).__name__}: {error}", "LastErrorTime": time.time()}
+
+    def record_reconnect(self) -> None:
+        with self.health_lock:
+            self.health["Reconnects"] += 1
+
+    # connect the first connection and start the event loop; a server that cannot be reached at all
+    # fails right away instead of being retried
+    def start(self):
+        client = Connection(self)
+        client.connect()
+        self.connections.append(client)
+        self.last_used[id(client)] = time.monotonic()
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self.setup(client), self.loop).result()
+        return client
+
+    async def setup(self, client) -> None:
+        self.idle = deque([client])
+        self.changed = asyncio.Condition()
+        self.waiting = 0
+        self.background = 0
+        self.keep_alive_task = asyncio.create_task(self.keep_alive())
+
+    # background requests (of jobs and prefetching) only get a connection while no foreground request
+    # is waiting, and leave one of the connections to the foreground
+    def available(self, background: bool) -> bool:
+        if len(self.idle) == 0 and len(self.connections) >= self.size:
+            return False
+        return not background or (self.waiting == 0 and self.background < max(1, self.size - 1))
+
+    async def acquire(self, background: bool = False):
+        async with self.changed:
+            if not background:
+                self.waiting += 1
+            try:
+                await self.changed.wait_for(lambda: self.available(background))
+            finally:
+                if not background:
+                    self.waiting -= 1
+            if background:
+                self.background += 1
+            if len(self.idle) > 0:
+                return self.idle.popleft()
+            client = Connection(self)
+            self.connections.append(client)
+            return client
+
+    async def release(self, client, background: bool = False) -> None:
+        async with self.changed:
+            if background:
+                self.background -= 1
+            self.last_used[id(client)] = time.monotonic()
+            self.idle.append(client)
+            self.changed.notify_all()
+
+    async def run(self, func, *args, background: bool = False):
+        client = await self.acquire(background)
+        try:
+            return await self.loop.run_in_executor(self.executor, func, client, *args)
+        finally:
+            await self.release(client, background)
+
+    # a request may take one of the idle connections while another one is pinged, so every connection
+    # is checked again (under the condition's lock) right before it is taken for its ping
+    async def keep_alive(self) -> None:
+        while True:
+            await asyncio.sleep(self.KEEP_ALIVE_CHECK)
+            for client in list(self.idle):
+                async with self.changed:
+                    if client not in self.idle \
+                            or time.monotonic() - self.last_used.get(id(client), 0) < self.KEEP_ALIVE_INTERVAL - self.KEEP_ALIVE_CHECK:
+                        continue
+                    self.idle.remove(client)
+                try:
+                    await self.loop.run_in_executor(self.executor, lambda: client.call("rfap_ping", retries=0))
+                except Exception:
+                    # a failed ping must not end the keep-alive; the connection is closed now and
+                    # reconnects on its next request
+                    pass
+                finally:
+                    await self.release(client)
+
+    # schedule func(client, *args) on the next free connection, returns a concurrent.futures.Future
+    def submit(self, func, *args, background: bool = False):
+        return asyncio.run_coroutine_threadsafe(self.run(func, *args, background=background), self.loop)
+
+    def call(self, func, *args, background: bool = False):
+        return self.submit(func, *args, background=background).result()
+
+    # run func(client, item) for every item, submitting at most `size` of them at a time so that
+    # requests of other callers do not queue up behind all of them
+    def map(self, func, items: list, background: bool = False) -> list:
+        results, running, pending = [None] * len(items), {}, deque(enumerate(items))
+        while len(pending) > 0 or len(running) > 0:
+            while len(pending) > 0 and len(running) < self.size:
+                i, item = pending.popleft()
+                running[self.submit(func, item, background=background)] = i
+            finished, _ = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+            for future in finished:
+                results[running.pop(future)] = future.result()
+        return results
+
+    async def shutdown(self) -> None:
+        self.keep_alive_task.cancel()
+        async with self.changed:
+            await self.changed.wait_for(lambda: len(self.idle) == len(self.connections))
+        while len(self.connections) > 0:
+            client = self.connections.pop()
+            await self.loop.run_in_executor(self.executor, client.rfap_disconnect)
+
+    def close(self) -> None:
+        asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.executor.shutdown()
+
+# stands in for librfap.Client on a connection to the connection daemon (see RfapCliApp.run_daemon),
+# which runs every rfap_* call on one of its warm server connections
+class DaemonClient:
+    def __init__(self, path: str):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.socket.connect(path)
+        except OSError as e:
+            self.socket.close()
+            raise ConnectionError(f"cannot connect to the connection daemon at {path}: {e}") from e
+        if self.peer_uid(self.socket) not in (None, os.getuid()):
+            self.socket.close()
+            raise PermissionError(f"the connection daemon at {path} belongs to another user")
+
+    # uid of the process at the other end of a unix socket, None where the system does not tell
+    @staticmethod
+    def peer_uid(connection):
+        if not hasattr(socket, "SO_PEERCRED"):
+            return None
+        credentials = connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+        return struct.unpack("3i", credentials)[1]
+
+    # bytes-like values are replaced by {"$body": n} and sent as raw frames after the JSON, straight
+    # from their buffer (e.g. a memory-mapped file); tuples are kept apart from lists as {"$tuple": [...]}
+    @staticmethod
+    def encode(value, bodies: list):
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            bodies.append(value)
+            return {"$body": len(bodies) - 1}
+        if isinstance(value, tuple):
+            return {"$tuple": [DaemonClient.encode(item, bodies) for item in value]}
+        if isinstance(value, list):
+            return [DaemonClient.encode(item, bodies) for item in value]
+        if isinstance(value, dict):
+            return {key: DaemonClient.encode(item, bodies) for key, item in value.items()}
+        return value
+
+    @staticmethod
+    def decode(value, bodies: list):
+        if isinstance(value, list):
+            return [DaemonClient.decode(item, bodies) for item in value]
+        if not isinstance(value, dict):
+            return value
+        if value.keys() == {"$body"}:
+            return bodies[value["$body"]]
+        if value.keys() == {"$tuple"}:
+            return tuple(DaemonClient.decode(item, bodies) for item in value["$tuple"])
+        return {key: DaemonClient.decode(item, bodies) for key, item in value.items()}
+
+    # messages are JSON objects prefixed with their length and the lengths of their body frames
+    @staticmethod
+    def send(connection, message: dict) -> None:
+        bodies = []
+        data = json.dumps(DaemonClient.encode(message, bodies), default=str).encode()
+        sizes = [memoryview(body).nbytes for body in bodies]
+        connection.sendall(struct.pack(f"!QI{len(sizes)}Q", len(data), len(sizes), *sizes))
+        connection.sendall(data)
+        for body in bodies:
+            connection.sendall(body)
+
+    @staticmethod
+    def receive(connection) -> dict:
+        def read(size: int):
+            buffer = bytearray(size)
+            view, done = memoryview(buffer), 0
+            while done < size:
+                if (count := connection.recv_into(view[done:])) == 0:
+                    raise ConnectionError("connection to the daemon closed")
+                done += count
+            return buffer
+        size, count = struct.unpack("!QI", read(12))
+        sizes = struct.unpack(f"!{count}Q", read(8 * count))
+        message = json.loads(read(size))
+        return DaemonClient.decode(message, [read(size) for size in sizes])
+
+    # errors of the daemon are raised again as the built-in exception of the same name
+    def call(self, name: str, *args):
+        self.send(self.socket, {"Request": name, "Args": list(args)})
+        reply = self.receive(self.socket)
+        if "Error" in reply:
+            error = getattr(builtins, reply["Error"], None)
+            if not isinstance(error, type) or not issubclass(error, Exception):
+                error = RuntimeError
+            raise error(reply["Message"])
+        return reply["Result"]
+
+    def __getattr__(self, name: str):
+        if not name.startswith("rfap_"):
+            raise AttributeError(name)
+        return lambda *args: self.call(name, *args)
+
+    def rfap_disconnect(self) -> None:
+        self.socket.close()
+
+# Engine counterpart for sessions that go through the connection daemon: the daemon keeps the
+# server connections warm, so every worker thread only holds its own connection to the daemon's socket
+class DaemonEngine:
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = max(1, size)
+        self.connections = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.health = {"Healthy": True, "Failures": 0, "Reconnects": 0, "LastError": None, "LastErrorTime": None}
+        self.executor = futures.ThreadPoolExecutor(max_workers=self.size)
+        # requests of jobs get threads of their own so that they never queue ahead of the foreground
+        self.background_executor = futures.ThreadPoolExecutor(max_workers=max(1, self.size - 1))
+
+    def connect(self) -> DaemonClient:
+        client = DaemonClient(self.path)
+        with self.lock:
+            self.connections.append(client)
+        return client
+
+    def start(self) -> DaemonClient:
+        return self.connect()
+
+    def run(self, func, *args):
+        if (client := getattr(self.local, "client", None)) is None:
+            client = self.local.client = self.connect()
+        return func(client, *args)
+
+    def submit(self, func, *args, background: bool = False):
+        executor = self.background_executor if background else self.executor
+        return executor.submit(self.run, func, *args)
+
+    def call(self, func, *args, background: bool = False):
+        return self.submit(func, *args, background=background).result()
+
+    map = Engine.map
+
+    def close(self) -> None:
+        self.executor.shutdown()
+        self.background_executor.shutdown()
+        for client in self.connections:
+            client.rfap_disconnect()
+
+# LRU cache for rfap_info and rfap_directory_read results, keyed by (kind, absolute path)
+class MetadataCache:
+    def __init__(self, settings: dict):
+        self.settings = settings
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, kind: str, path: str) -> tuple:
+        while len(path) > 1 and path.endswith("/"):
+            path = path[:-1]
+        return (kind, path)
+
+    def get(self, kind: str, path: str):
+        key = self.key(kind, path)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > float(self.settings["CacheTTL"]):
+                self.entries.pop(key, None)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, kind: str, path: str, value) -> None:
+        if int(self.settings["CacheSize"]) <= 0:
+            return
+        key = self.key(kind, path)
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > int(self.settings["CacheSize"]):
+                self.entries.popitem(last=False)
+
+    # drop everything cached for path, its subtree and the listing of its parent directory
+    def invalidate(self, path: str, parent: str) -> None:
+        _, path = self.key("", path)
+        _, parent = self.key("", parent)
+        with self.lock:
+            for key in list(self.entries):
+                if key[1] == path or key[1].startswith(path + "/") or key == ("ls", parent):
+                    del self.entries[key]
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+# on-disk LRU cache of remote file contents, keyed by server, path, size and mtime,
+# so that a cheap rfap_info is enough to tell whether a cached copy is still current
+class ContentCache:
+    # fraction of ContentCacheSize that evict trims the cache down to
+    LOW_WATER = 0.9
+
+    def __init__(self, settings: dict, directory: str):
+        self.settings = settings
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.size = None
+
+    def enabled(self) -> bool:
+        return int(self.settings["ContentCacheSize"]) > 0
+
+    def file(self, path: str, metadata: dict):
+        if metadata.get("Size") is None or metadata.get("Modified") is None:
+            return None
+        key = f"{self.settings['Server']}:{self.settings['Port']}:{path}:{metadata['Size']}:{metadata['Modified']}"
+        return os.path.join(self.directory, hashlib.sha256(key.encode("utf-8")).hexdigest())
+
+    def get(self, path: str, metadata: dict):
+        if not self.enabled() or (file := self.file(path, metadata)) is None:
+            return None
+        try:
+            with open(file, "rb") as f:
+                content = f.read()
+            os.utime(file)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return content
+
+    def put(self, path: str, metadata: dict, content) -> None:
+        if not self.enabled() or (file := self.file(path, metadata)) is None \
+                or len(content) != metadata["Size"] or len(content) > int(self.settings["ContentCacheSize"]):
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=self.directory, suffix=".part")
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        with self.lock:
+            if self.size is not None and not os.path.exists(file):
+                self.size += len(content)
+            os.replace(temp, file)
+        if self.size is None or self.size > int(self.settings["ContentCacheSize"]):
+            self.evict()
+
+    # remove the least recently used files until the cache is down to LOW_WATER of ContentCacheSize;
+    # the directory is only scanned once and then whenever the running total exceeds the limit,
+    # which the headroom left below it keeps from happening on every put
+    def evict(self) -> None:
+        with self.lock:
+            files = []
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and not entry.name.endswith(".part"):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in files)
+            if total > int(self.settings["ContentCacheSize"]):
+                for _, size, file in sorted(files):
+                    if total <= int(self.settings["ContentCacheSize"]) * self.LOW_WATER:
+                        break
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(file)
+                    total -= size
+            self.size = total
+
+    def clear(self) -> None:
+        if os.path.isdir(self.directory):
+            shutil.rmtree(self.directory)
+        self.size = None
+
+# sorted list of the remote paths seen in listings and rfap_info results (folders with a trailing slash),
+# stored gzipped in the cache folder; answers path completion and locate without a round trip
+class PathIndex:
+    def __init__(self, settings: dict, file: str):
+        self.settings = settings
+        self.file = file
+        self.entries = None
+        self.text = None
+        self.dirty = False
+        self.lock = threading.RLock()
+
+    def enabled(self) -> bool:
+        return bool(self.settings["PathIndex"])
+
+    def load(self) -> list:
+        with self.lock:
+            if self.entries is None:
+                try:
+                    with gzip.open(self.file, "rt", encoding="utf-8") as f:
+                        self.entries = [entry for entry in f.read().split("\n") if entry != ""]
+                except (OSError, EOFError):
+                    self.entries = []
+            return self.entries
+
+    def save(self) -> None:
+        with self.lock:
+            if not self.dirty:
+                return
+            os.makedirs(os.path.dirname(self.file), exist_ok=True)
+            fd, temp = tempfile.mkstemp(dir=os.path.dirname(self.file), suffix=".part")
+            with os.fdopen(fd, "wb") as f:
+                f.write(gzip.compress("\n".join(self.entries).encode("utf-8"), compresslevel=1))
+            os.replace(temp, self.file)
+            self.dirty = False
+
+    def changed(self) -> None:
+        self.text = None
+        self.dirty = True
+
+    # first and last+1 index of the entries starting with prefix
+    def span(self, prefix: str) -> tuple:
+        entries = self.load()
+        return bisect_left(entries, prefix), bisect_left(entries, prefix + "\U0010ffff")
+
+    # direct children below prefix as (name, start, end), jumping over the entries of subfolders; a folder
+    # that is also stored without its slash (seen in a listing before its own entries were added) is
+    # yielded as a folder for both parts
+    def scan(self, prefix: str):
+        entries = self.load()
+        i, end = self.span(prefix)
+        if i < end and entries[i] == prefix:
+            i += 1
+        while i < end:
+            name, slash, _ = entries[i][len(prefix):].partition("/")
+            if slash == "":
+                folder = prefix + name + "/"
+                if (j := bisect_left(entries, folder, i, end)) < end and entries[j].startswith(folder):
+                    name += "/"
+                yield name, i, i + 1
+                i += 1
+                continue
+            subtree_end = bisect_left(entries, prefix + name + "/\U0010ffff", i, end)
+            yield name + "/", i, subtree_end
+            i = subtree_end
+
+    def children(self, directory: str) -> list:
+        with self.lock:
+            return list(dict.fromkeys(name for name, _, _ in self.scan(directory.rstrip("/") + "/")))
+
+    # replace the children of directory with names, keeping what is known about the ones that still exist;
+    # names already stored as folders are not added again without their slash
+    def update(self, directory: str, names: list) -> None:
+        prefix = directory.rstrip("/") + "/"
+        names = set(names)
+        with self.lock:
+            entries = self.load()
+            known, removed = set(), []
+            for name, start, end in self.scan(prefix):
+                if name.endswith("/") and entries[start] == prefix + name.rstrip("/"):
+                    removed.append((start, end))
+                elif name.rstrip("/") in names:
+                    known.add(name.rstrip("/"))
+                else:
+                    removed.append((start, end))
+            for start, end in reversed(removed):
+                del entries[start:end]
+            added = sorted(prefix + name for name in names - known)
+            if len(added) > 16:
+                start, end = self.span(prefix)
+                entries[start:end] = sorted(entries[start:end] + added)
+            else:
+                for entry in added:
+                    insort(entries, entry)
+            if len(removed) > 0 or len(names) > len(known):
+                self.changed()
+
+    def add(self, path: str, is_directory: bool) -> None:
+        if (path := path.rstrip("/")) == "":
+            return
+        entry, other = (path + "/", path) if is_directory else (path, path + "/")
+        with self.lock:
+            entries = self.load()
+            i = bisect_left(entries, entry)
+            if i < len(entries) and entries[i] == entry:
+                return
+            if (j := bisect_left(entries, other)) < len(entries) and entries[j] == other:
+                del entries[j]
+            insort(entries, entry)
+            self.changed()
+
+    def remove(self, path: str) -> None:
+        if (path := path.rstrip("/")) == "":
+            return
+        with self.lock:
+            entries = self.load()
+            start, end = self.span(path + "/")
+            del entries[start:end]
+            if (i := bisect_left(entries, path)) < len(entries) and entries[i] == path:
+                del entries[i]
+            self.changed()
+
+    # paths containing pattern, or matching it as a whole if it has * or ? wildcards
+    def locate(self, pattern: str, ignore_case: bool = False) -> list:
+        with self.lock:
+            if self.text is None:
+                self.text = "\n".join(self.load())
+            text = self.text
+        expression = "".join("[^\n]*" if c == "*" else "[^\n]" if c == "?" else re.escape(c) for c in pattern)
+        if "*" not in pattern and "?" not in pattern:
+            expression = f"[^\n]*{expression}[^\n]*"
+        flags = re.MULTILINE | (re.IGNORECASE if ignore_case else 0)
+        return re.findall(f"^{expression}$", text, flags)
+
+# latency, traffic and error codes of every librfap request, per request type
+class Stats:
+    SAMPLES = 100000
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self.lock:
+            self.operations = {}
+
+    def record(self, name: str, seconds: float, bytes_in: int, bytes_out: int, error_code) -> None:
+        with self.lock:
+            operation = self.operations.setdefault(name, {
+                "Count": 0, "Seconds": 0.0, "BytesIn": 0, "BytesOut": 0, "Errors": {},
+                "Latencies": deque(maxlen=self.SAMPLES)
+                })
+            operation["Count"] += 1
+            operation["Seconds"] += seconds
+            operation["BytesIn"] += bytes_in
+            operation["BytesOut"] += bytes_out
+            operation["Latencies"].append(seconds)
+            if error_code not in (0, None):
+                operation["Errors"][str(error_code)] = operation["Errors"].get(str(error_code), 0) + 1
+
+    def percentile(self, latencies: list, percent: int) -> float:
+        if len(latencies) == 0:
+            return 0.0
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percent / 100))]
+
+    def summary(self) -> dict:
+        result = {}
+        with self.lock:
+            for name, operation in sorted(self.operations.items()):
+                latencies = sorted(operation["Latencies"])
+                result[name] = {
+                    "Count": operation["Count"],
+                    "Errors": dict(operation["Errors"]),
+                    "BytesIn": operation["BytesIn"],
+                    "BytesOut": operation["BytesOut"],
+                    "Seconds": operation["Seconds"],
+                    "P50": self.percentile(latencies, 50),
+                    "P95": self.percentile(latencies, 95),
+                    "P99": self.percentile(latencies, 99)
+                    }
+        return result
+
+# raised inside a background job once it has been killed
+class JobKilled(Exception):
+    pass
+
+# a command running in the background on its own copy of the app
+class Job:
+    def __init__(self, number: int, command: str, line_number: int):
+        self.number = number
+        self.command = command
+        self.line_number = line_number
+        self.status = "running"
+        self.started = time.monotonic()
+        self.finished = None
+        self.bytes_done = 0
+        self.messages = []
+        self.killed = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def add_bytes(self, count: int) -> None:
+        with self.lock:
+            self.bytes_done += count
+
+    def elapsed(self) -> float:
+        return (self.finished or time.monotonic()) - self.started
+
+    def rate(self) -> float:
+        return self.bytes_done / self.elapsed() if self.elapsed() > 0 else 0
+
+# read-only view of a remote file for the line based commands; librfap 0.3.0 has no ranged
+# read, so the first access fetches the file once and later ranges are served from that copy
+class RemoteFile:
+    def __init__(self, app, path: str):
+        self.app = app
+        self.path = path
+        self.content = None
+        self.file_type = None
+
+    def open(self) -> dict:
+        metadata, content = self.app.fetch_file(self.path)
+        if metadata["ErrorCode"] != 0:
+            return metadata
+        self.file_type = metadata.get("FileType") or "text/plain"
+        self.content = memoryview(content)
+        return metadata
+
+    def size(self) -> int:
+        return len(self.content)
+
+    def read(self, offset: int, length: int) -> memoryview:
+        return self.content[offset:offset + length]
+
+    # decoded lines from offset on, decoding one ChunkSize piece at a time
+    def lines(self, offset: int = 0):
+        chunk_size = int(self.app.settings["ChunkSize"])
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        rest = ""
+        while offset < self.size():
+            text = rest + decoder.decode(self.read(offset, chunk_size))
+            offset += chunk_size
+            *lines, rest = text.split("\n")
+            for line in lines:
+                yield line + "\n"
+        rest += decoder.decode(b"", final=True)
+        if rest != "":
+            yield rest
+
+# stands in for colorama's Fore/Back/Style when the output has to stay free of escape codes
+class NoStyle:
+    def __getattr__(self, name: str) -> str:
+        return ""
+
+# stdout in json output mode: text a command prints is collected per thread and becomes
+# its result, anything printed outside of a command goes to the real stdout
+class CapturedOutput:
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def begin(self) -> None:
+        self.local.buffer = io.StringIO()
+
+    def end(self) -> str:
+        text, self.local.buffer = self.local.buffer.getvalue(), None
+        return text
+
+    def write(self, text: str) -> int:
+        if (buffer := getattr(self.local, "buffer", None)) is not None:
+            return buffer.write(text)
+        return self.stream.write(text)
+
+    def flush(self) -> None:
+        self.stream.flush()
+
+    def __getattr__(self, name: str):
+        return getattr(self.stream, name)
 
 class RfapCliApp:
     # default settings
@@ -19,24 +819,55 @@ class RfapCliApp:
             "Port": 6700,
             "ColoredLS": False,
             "Debug": False,
+            "Workers": 8,
+            "CacheTTL": 10,
+            "CacheSize": 4096,
+            "ChunkSize": 1024 * 1024,
+            "Progress": True,
+            "SyncBlockSize": 4 * 1024 * 1024,
+            "ContentCacheSize": 512 * 1024 * 1024,
+            "PathIndex": True,
+            "UseDaemon": False,
+            "Retries": 6,
+            "RetryDelay": 0.5,
+            "StatsFile": None,
+            "Output": "text",
             "Editor": "[built-in]",
             "Tempfile": os.path.join(tempfile.gettempdir(), "rfap-pycli.temp")
             }
     SUPPORTED_LIBRFAP_VERSIONS = ["0.3.0"]
+    EXIT_COMMANDS = ("exit", "quit", "disconnect", ":q")
+    SYNC_MANIFEST = ".rfap-sync.json"
+    ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+    BACKGROUND_COMMANDS = ("copy", "cp", "copydir", "cpdir", "mget", "getdir", "move", "mv", "rename",
+                           "movedir", "mvdir", "mput", "putdir", "save", "download", "dl", "sync", "upload", "index")
+
+    # exit codes of batch mode
+    EXIT_OK = 0
+    EXIT_FAILED = 1
+    EXIT_USAGE = 2
+    EXIT_CONNECTION = 3
 
     # app init
     def __init__(self):
-        print("Welcome to rfap-pycli!")
-        print(f"OS info: {platform()} with Python {sys.version}, librfap v{librfap.__version__}")
-        if librfap.__version__ not in self.SUPPORTED_LIBRFAP_VERSIONS:
-            print("Error: you are using an unsupported version of librfap")
-            print(f"{librfap.__version__} not in {self.SUPPORTED_LIBRFAP_VERSIONS}")
-            sys.exit(1)
+        self.failed = False
+        self.job = None
+        self.jobs = []
+        self.stats = Stats()
+        self.progress = None
+        self.progress_lock = threading.Lock()
+        self.output = None
+        self.output_lock = threading.Lock()
+        self.parse_args()
+        self.log("Welcome to rfap-pycli!")
 
-        colorama.init()
-        self.style = colorama.Style
-        self.style_fg = colorama.Fore
-        self.style_bg = colorama.Back
+        if self.interactive:
+            colorama.init()
+            self.style = colorama.Style
+            self.style_fg = colorama.Fore
+            self.style_bg = colorama.Back
+        else:
+            self.style = self.style_fg = self.style_bg = NoStyle()
 
         if not (config := os.getenv("RFAP_PYCLI_CONFIG")) is None:
             self.config_file = config
@@ -45,6 +876,11 @@ class RfapCliApp:
         else:
             self.config_file = os.path.expanduser("~/.config/rfap-pycli/config.yml")
 
+        if not (xdg_cache := os.getenv("XDG_CACHE_HOME")) is None:
+            self.cache_dir = os.path.join(xdg_cache, "rfap-pycli")
+        else:
+            self.cache_dir = os.path.expanduser("~/.cache/rfap-pycli")
+
         self.prompt = f"{self.style_fg.CYAN}rfap {self.style_fg.BLUE}%s{self.style.RESET_ALL} > "
         self.pwd = "/"
         self.cmd = ""
@@ -52,34 +888,115 @@ class RfapCliApp:
 
         self.configure()
 
-        print(f"{self.style_fg.YELLOW}Connecting to {self.settings['Server']}:{self.settings['Port']}...{self.style.RESET_ALL}")
-        self.client = librfap.Client(self.settings["Server"], port=self.settings["Port"])
+        try:
+            self.connect()
+        except OSError as e:
+            self.print_error(f"cannot connect to {self.settings['Server']}:{self.settings['Port']}: {e}")
+            sys.exit(self.EXIT_CONNECTION)
+        self.cache = MetadataCache(self.settings)
+        self.content_cache = ContentCache(self.settings, os.path.join(self.cache_dir, "content"))
+        self.index = PathIndex(self.settings, os.path.join(self.cache_dir, f"index-{self.settings['Server']}-{self.settings['Port']}.gz"))
+        self.prefetched = set()
+        if self.interactive and readline.available():
+            readline.set_completer(self.complete)
+            readline.set_completer_delims(" \t\n")
+            readline.parse_and_bind("tab: complete")
+
+        if not self.quiet:
+            self.cmd_ping()
+            self.print_success(f"Connected to {self.settings['Server']}:{self.settings['Port']}")
 
-        self.running = True
-        self.time_left = 60
-        self.keep_alive_thread = threading.Thread(target=self.keep_alive)
-        self.socket_lock = threading.Lock()
-        self.keep_alive_thread.start()
-        print("Started keep-alive-thread")
+    # go through the connection daemon if one is running for this server, otherwise connect directly
+    def connect(self) -> None:
+        path = self.daemon_socket()
+        if self.settings["UseDaemon"] and not self.daemon and path is not None and os.path.exists(path):
+            try:
+                if os.stat(path).st_uid != os.getuid():
+                    raise PermissionError("the socket belongs to another user")
+                self.engine = DaemonEngine(path, int(self.settings["Workers"]))
+                self.engine.start()
+                self.log(f"Using connection daemon at {path}")
+                return
+            except OSError as e:
+                self.log(f"cannot use connection daemon at {path}: {e}")
+        if self.interactive and not self.quiet:
+            self.log(f"OS info: {platform.platform()} with Python {sys.version}, librfap v{librfap.__version__}")
+        if librfap.__version__ not in self.SUPPORTED_LIBRFAP_VERSIONS:
+            print("Error: you are using an unsupported version of librfap")
+            print(f"{librfap.__version__} not in {self.SUPPORTED_LIBRFAP_VERSIONS}")
+            sys.exit(1)
+        self.log(f"{self.style_fg.YELLOW}Connecting to {self.settings['Server']}:{self.settings['Port']}...{self.style.RESET_ALL}")
+        self.engine = Engine(self.settings["Server"], self.settings["Port"], int(self.settings["Workers"]),
+                             int(self.settings["Retries"]), float(self.settings["RetryDelay"]))
+        self.engine.start()
+        self.log("Started request engine")
 
-        self.cmd_ping()
-        self.print_success(f"Connected to {self.settings['Server']}:{self.settings['Port']}")
+    # unix socket of the connection daemon for the configured server, in $XDG_RUNTIME_DIR or else in a
+    # 0700 directory of this user in the temp dir (created with create); None where unix sockets are not
+    # available or the directory is missing or accessible to other users
+    def daemon_socket(self, create: bool = False):
+        if not hasattr(socket, "AF_UNIX") or not hasattr(os, "getuid"):
+            return None
+        if (directory := os.getenv("XDG_RUNTIME_DIR")) is None:
+            directory = os.path.join(tempfile.gettempdir(), f"rfap-pycli-{os.getuid()}")
+            if create:
+                try:
+                    os.mkdir(directory, 0o700)
+                except FileExistsError:
+                    pass
+        try:
+            stat = os.lstat(directory)
+        except OSError:
+            return None
+        if not S_ISDIR(stat.st_mode) or stat.st_uid != os.getuid() or stat.st_mode & 0o077:
+            return None
+        return os.path.join(directory, f"rfap-pycli-{self.settings['Server']}-{self.settings['Port']}.sock")
 
     # helper functions
+    def parse_args(self):
+        try:
+            self.options, _ = getopt.getopt(sys.argv[1:], "s:cdf:kyq",
+                ["server-address=", "colored-ls", "debug", "file=", "keep-going", "yes", "stats=", "quiet", "daemon", "json"])
+        except getopt.GetoptError as e:
+            print(f"Error: {e}.", file=sys.stderr)
+            print("Usage:", sys.argv[0], "[-d] [-c] [-q] [-s server_address] [-f script [-k] [-y]] [--stats file] [--json] [--daemon]", file=sys.stderr)
+            sys.exit(self.EXIT_USAGE)
+        self.script = None
+        self.keep_going = False
+        self.assume_yes = False
+        self.quiet = False
+        self.daemon = False
+        for opt, arg in self.options:
+            if opt in ("-q", "--quiet"):
+                self.quiet = True
+                continue
+            if opt == "--daemon":
+                self.daemon = True
+                continue
+            if opt in ("-f", "--file"):
+                self.script = arg
+                continue
+            if opt in ("-k", "--keep-going"):
+                self.keep_going = True
+                continue
+            if opt in ("-y", "--yes"):
+                self.assume_yes = True
+                continue
+            # applied here already, so that nothing is logged as plain text before the JSON lines;
+            # configure sets it again over the config file
+            if opt == "--json":
+                self.settings["Output"] = "json"
+        self.interactive = self.script is None and not self.daemon
+        self.line_number = 0
+
     def configure(self):
         if os.path.exists(self.config_file):
-            print(f"loading config file {self.config_file}...")
+            self.log(f"loading config file {self.config_file}...")
             with open(self.config_file, "r") as f:
                 config = yaml.load(f.read(), Loader=yaml.SafeLoader)
                 if not config is None:
                     self.settings |= config
-        try:
-            opts, _ = getopt.getopt(sys.argv[1:], "s:cd", ["server-address=", "--colored-ls", "--debug"])
-        except getopt.GetoptError:
-            self.print_error(f"invalid arguments")
-            print("Usage:", sys.argv[0], "[-d] [-c] [-s server_address]")
-            sys.exit(1)
-        for opt, arg in opts:
+        for opt, arg in self.options:
             if opt in ("-s", "--server-address"):
                 self.settings["Server"] = arg
                 continue
@@ -88,6 +1005,12 @@ class RfapCliApp:
                 continue
             if opt in ("-d", "--debug"):
                 self.settings["Debug"] = True
+                continue
+            if opt == "--stats":
+                self.settings["StatsFile"] = arg
+                continue
+            if opt == "--json":
+                self.settings["Output"] = "json"
         if (editor := os.getenv("EDITOR")) is not None:
             self.settings["Editor"] = editor
 
@@ -96,21 +1019,11 @@ class RfapCliApp:
             return os.getenv(name)
         return default
 
-    def keep_alive(self):
-        while True:
-            if not self.running:
-                return
-            time.sleep(5)
-            self.socket_lock.acquire()
-            if self.time_left <= 5:
-                self.client.rfap_ping()
-                self.time_left = 60
-            else:
-                self.time_left -= 5
-            self.socket_lock.release()
-
     def enter_cmd(self):
         inp = input(self.prompt % self.pwd).split()
+        if len(inp) == 0:
+            self.cmd, self.args = "", ()
+            return
         self.cmd, self.args = inp[0], tuple(inp[1:])
 
     def abspath(self, path: str) -> str:
@@ -138,20 +1051,818 @@ class RfapCliApp:
     def parent_dir(self, path: str) -> str:
         if path == "/":
             return "/"
-        return "/" + "/".join(path.split("/")[:-1])
+        parent = "/".join(path.rstrip("/").split("/")[:-1])
+        if parent == "":
+            return "/"
+        return parent
+
+    def split_path(self, path: str) -> list:
+        return [part for part in path.split("/") if part != ""]
+
+    def join_path(self, directory: str, name: str) -> str:
+        if directory.endswith("/"):
+            return directory + name
+        return directory + "/" + name
+
+    # run a librfap request through the engine, or directly on client if the caller already holds a connection
+    def request(self, name: str, *args, client=None):
+        start = time.monotonic()
+        try:
+            if client is not None:
+                result = getattr(client, name)(*args)
+            else:
+                result = self.engine.call(lambda client: getattr(client, name)(*args), background=self.job is not None)
+        except Exception:
+            self.stats.record(name, time.monotonic() - start, 0, 0, "exception")
+            raise
+        metadata, bytes_in = result, 0
+        if isinstance(result, tuple):
+            metadata, body = result
+            bytes_in = len(body) if isinstance(body, (bytes, bytearray)) else sum(len(entry) for entry in body)
+        bytes_out = sum(len(arg) for arg in args if isinstance(arg, (bytes, bytearray, memoryview)))
+        error_code = metadata.get("ErrorCode") if isinstance(metadata, dict) else None
+        self.stats.record(name, time.monotonic() - start, bytes_in, bytes_out, error_code)
+        return result
+
+    def info(self, path: str, cached: bool = True, client=None) -> dict:
+        if cached and (metadata := self.cache.get("info", path)) is not None:
+            return metadata
+        metadata = self.request("rfap_info", path, client=client)
+        if metadata["ErrorCode"] == 0:
+            self.cache.put("info", path, metadata)
+            if self.index.enabled():
+                self.index.add(path, metadata.get("Type") == "d")
+        return metadata
+
+    def directory_read(self, path: str, cached: bool = True, client=None) -> tuple:
+        if cached and (listing := self.cache.get("ls", path)) is not None:
+            return listing
+        metadata, files = self.request("rfap_directory_read", path, client=client)
+        if metadata["ErrorCode"] == 0:
+            self.cache.put("ls", path, (metadata, files))
+            if self.index.enabled():
+                self.index.add(path, True)
+                self.index.update(path, files)
+        return metadata, files
+
+    # drop the cached metadata of paths a command changed; removed paths (deleted or moved away) also
+    # leave the index, the others stay in it
+    def invalidate(self, *paths: str, removed: bool = False) -> None:
+        for path in paths:
+            self.cache.invalidate(path, self.parent_dir(path))
+            if removed and self.index.enabled():
+                self.index.remove(path)
+
+    # add a path a command has just created, so that completion and locate know it right away
+    def add_to_index(self, path: str, is_directory: bool) -> None:
+        if self.index.enabled():
+            self.index.add(path, is_directory)
+
+    # refresh the index entries of directory in the background, once per session
+    def prefetch(self, directory: str) -> None:
+        if not self.index.enabled() or directory in self.prefetched:
+            return
+        self.prefetched.add(directory)
+        self.engine.submit(lambda client, path: self.directory_read(path, cached=False, client=client), directory, background=True)
+
+    # readline completer: command names for the first word, remote paths from the index for the others
+    def complete(self, text: str, state: int):
+        if state == 0:
+            self.completions = []
+            if readline.get_line_buffer()[:readline.get_begidx()].strip() == "":
+                commands = [name[4:] for name in dir(self) if name.startswith("cmd_")] + list(self.EXIT_COMMANDS)
+                self.completions = sorted(command for command in commands if command.startswith(text))
+            elif self.index.enabled():
+                head, slash, tail = text.rpartition("/")
+                directory = "/" if text.startswith("/") and head == "" else self.abspath(head) if slash else self.pwd
+                directory = "/" + "/".join(self.split_path(directory))
+                self.prefetch(directory)
+                self.completions = [head + slash + name for name in self.index.children(directory) if name.startswith(tail)]
+        return self.completions[state] if state < len(self.completions) else None
+
+    # rfap_info for many paths, spread over the engine's connections instead of one round trip after another
+    def stat_many(self, paths: list, cached: bool = True) -> list:
+        results = [self.cache.get("info", path) if cached else None for path in paths]
+        missing = [i for i, metadata in enumerate(results) if metadata is None]
+        fetched = self.engine.map(lambda client, path: self.request("rfap_info", path, client=client),
+                                  [paths[i] for i in missing], background=self.job is not None)
+        for i, metadata in zip(missing, fetched):
+            if metadata["ErrorCode"] == 0:
+                self.cache.put("info", paths[i], metadata)
+                if self.index.enabled():
+                    self.index.add(paths[i], metadata.get("Type") == "d")
+            results[i] = metadata
+        return results
+
+    # breadth-first walk of the remote tree below root, yielding (path, depth, metadata) as the results arrive;
+    # directory reads and rfap_info calls of all levels overlap, with at most 4 requests per connection queued,
+    # and queued rfap_info calls go first so that only a few listings are held in memory at once
+    def crawl(self, root: str, max_depth: int = None, cached: bool = True):
+        metadata = self.info(root, cached)
+        if metadata["ErrorCode"] != 0:
+            self.print_error(f"cannot read '{root}': {metadata['ErrorMessage']}")
+            return
+        yield root, 0, metadata
+        if metadata.get("Type") != "d" or max_depth == 0:
+            return
+        directories, stats, running = deque([(root, 0)]), deque(), {}
+        limit, background = 4 * self.engine.size, self.job is not None
+        while len(directories) > 0 or len(stats) > 0 or len(running) > 0:
+            self.check_killed()
+            while len(running) < limit and len(stats) > 0:
+                path, depth = stats.popleft()
+                running[self.engine.submit(lambda client, path: self.info(path, cached, client=client), path, background=background)] = (path, depth, False)
+            while len(running) < limit and len(directories) > 0 and len(stats) < limit:
+                path, depth = directories.popleft()
+                running[self.engine.submit(lambda client, path: self.directory_read(path, cached, client=client), path, background=background)] = (path, depth, True)
+            finished, _ = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+            for future in finished:
+                path, depth, is_listing = running.pop(future)
+                if is_listing:
+                    metadata, names = future.result()
+                    if metadata["ErrorCode"] != 0:
+                        self.print_error(f"cannot read '{path}': {metadata['ErrorMessage']}")
+                        continue
+                    stats.extend((self.join_path(path, name), depth + 1) for name in names)
+                    continue
+                metadata = future.result()
+                if metadata["ErrorCode"] != 0:
+                    self.print_error(f"cannot read '{path}': {metadata['ErrorMessage']}")
+                    continue
+                yield path, depth, metadata
+                if metadata.get("Type") == "d" and (max_depth is None or depth < max_depth):
+                    directories.append((path, depth))
+
+    # returns the directories below root (root first) and a list of (path, metadata) for the files,
+    # or None (after printing the error) if root cannot be read or is not a folder
+    def walk_remote(self, root: str, cached: bool = True):
+        directories, files = [], []
+        for path, _, metadata in self.crawl(root, cached=cached):
+            if metadata.get("Type") == "d":
+                directories.append(path)
+            elif path == root:
+                self.print_error(f"'{root}' is not a folder")
+                return None
+            else:
+                files.append((path, metadata))
+        if len(directories) == 0:
+            return None
+        return directories, files
+
+    # create the remote counterparts of the folders below the local folder source,
+    # returns a list of (local path, remote path) for the files or None on error
+    def prepare_upload(self, source: str, destin: str):
+        items = []
+        for directory, _, names in os.walk(source):
+            remote_directory = destin
+            if (relative := os.path.relpath(directory, source)) != ".":
+                remote_directory = self.join_path(destin, relative.replace(os.sep, "/"))
+            if self.info(remote_directory, cached=False).get("Type") != "d":
+                metadata = self.request("rfap_directory_create", remote_directory)
+                self.invalidate(remote_directory)
+                if metadata["ErrorCode"] != 0:
+                    self.print_error(f"cannot create '{remote_directory}': {metadata['ErrorMessage']}")
+                    return None
+                self.add_to_index(remote_directory, True)
+            for name in names:
+                items.append((os.path.join(directory, name), self.join_path(remote_directory, name)))
+        return items
+
+    # run func(client, item) for every item through the engine, collecting errors instead of stopping
+    def transfer_many(self, func, items: list) -> list:
+        def run(client, item):
+            if self.job is not None and self.job.killed.is_set():
+                return f"{item[0]}: killed"
+            try:
+                metadata = func(client, item)
+            except OSError as e:
+                return f"{item[0]}: {e}"
+            if metadata["ErrorCode"] != 0:
+                return f"{item[0]}: {metadata['ErrorMessage']}"
+            return None
+        return [error for error in self.engine.map(run, items, background=self.job is not None) if error is not None]
 
     def confirm(self, msg: str = "Do you really want to continue"):
+        if self.assume_yes:
+            return True
+        if self.job is not None:
+            self.print_error(f"{msg}? cannot ask in a background job")
+            return False
+        if not self.interactive:
+            self.print_error(f"{msg}? not confirmed, pass -y to confirm in batch mode")
+            return False
         inp = input(f"{self.style_fg.YELLOW}{msg} [y/n]? {self.style.RESET_ALL}")
         if inp in ("y", "Y", "yes", "YES", "Yes"):
             return True
         return False
 
+    # informational output, only shown in interactive mode
+    def log(self, message: str) -> None:
+        if self.json_output():
+            return
+        if self.job is not None:
+            self.job.messages.append((False, message))
+            return
+        if self.interactive and not self.quiet:
+            print(message)
+
     def print_success(self, message: str) -> None:
-        print(f"{self.style_fg.GREEN}{message}{self.style.RESET_ALL}")
+        if self.output is not None:
+            self.output["Messages"].append(message)
+            return
+        if self.job is not None:
+            self.job.messages.append((False, message))
+            return
+        self.log(f"{self.style_fg.GREEN}{message}{self.style.RESET_ALL}")
 
     def print_error(self, message: str) -> None:
+        self.failed = True
+        if self.output is not None:
+            self.output["Errors"].append(message)
+            return
+        if self.job is not None:
+            self.job.messages.append((True, message))
+            return
+        if not self.interactive:
+            location = f"{self.script}:{self.line_number}: " if self.script is not None and self.line_number > 0 else ""
+            print(f"{location}Error: {message}.", file=sys.stderr)
+            return
         print(f"{self.style_fg.RED}Error: {message}.{self.style.RESET_ALL}")
 
+    # json output mode (--json or Output: json): every command prints a single JSON object line
+    # when it ends, ls, find, info and locate print one line per entry before that
+    def json_output(self) -> bool:
+        return self.settings["Output"] == "json"
+
+    def write_json(self, line: dict) -> None:
+        if self.job is not None:
+            line = {"Job": self.job.number} | line
+        stream = sys.stdout.stream if isinstance(sys.stdout, CapturedOutput) else sys.stdout
+        with self.output_lock:
+            stream.write(json.dumps(line, default=str) + "\n")
+            stream.flush()
+
+    def emit_record(self, record: dict) -> None:
+        self.write_json({"Command": self.cmd, "Record": record})
+
+    # structured result (and the metadata of the command's request) of the running command,
+    # ignored outside of json output mode
+    def set_result(self, result, metadata: dict = None) -> None:
+        if self.output is None:
+            return
+        self.output["Result"] = result
+        if metadata is not None:
+            self.output["Metadata"] = metadata
+
+    def emit_result(self, text: str, seconds: float) -> None:
+        line = {"Command": self.cmd, "Args": list(self.args)}
+        if self.script is not None:
+            line["Line"] = self.line_number
+        text = self.ANSI_ESCAPE.sub("", text)
+        self.write_json(line | {
+            "ErrorCode": 1 if self.failed else 0,
+            "Result": self.output["Result"] if self.output["Result"] is not None else text or None,
+            "Metadata": self.output["Metadata"],
+            "Messages": self.output["Messages"],
+            "Errors": self.output["Errors"],
+            "Seconds": round(seconds, 6)
+            })
+
+    # expand wildcards in the last component of each argument against a single listing of its folder,
+    # returns the absolute paths or None if a pattern cannot be expanded; names that exist as they are
+    # (like 'a[1].log') are taken literally
+    def expand_paths(self, args: list):
+        paths, listings = [], {}
+        for arg in args:
+            path = self.abspath(arg)
+            directory, _, pattern = path.rstrip("/").rpartition("/")
+            directory = directory or "/"
+            if any(c in directory for c in "*?[") and self.info(directory).get("Type") != "d":
+                self.print_error(f"'{arg}': wildcards are only supported in the last path component")
+                return None
+            if not any(c in pattern for c in "*?["):
+                paths.append(path)
+                continue
+            if directory not in listings:
+                metadata, names = self.directory_read(directory, cached=False)
+                if metadata["ErrorCode"] != 0:
+                    self.print_error(f"cannot read '{directory}': {metadata['ErrorMessage']}")
+                    return None
+                listings[directory] = names
+            if pattern in listings[directory]:
+                matches = [pattern]
+            else:
+                matches = sorted(name for name in listings[directory] if fnmatch.fnmatchcase(name, pattern)
+                                 and (pattern.startswith(".") or not name.startswith(".")))
+            if len(matches) == 0:
+                self.print_error(f"no match for '{arg}'")
+                return None
+            paths += [self.join_path(directory, name) for name in matches]
+        return paths
+
+    # run one librfap request per item (a tuple of its arguments) spread over the engine's connections,
+    # returns (item, error message) for every request that failed
+    def request_many(self, name: str, items: list) -> list:
+        def run(client, item):
+            if self.job is not None and self.job.killed.is_set():
+                return item, "killed"
+            try:
+                metadata = self.request(name, *item, client=client)
+            except OSError as e:
+                return item, str(e)
+            if metadata["ErrorCode"] != 0:
+                return item, metadata["ErrorMessage"]
+            return None
+        return [error for error in self.engine.map(run, items, background=self.job is not None) if error is not None]
+
+    # report the outcome of a bulk operation, with the failures grouped by error message
+    def print_bulk_summary(self, verb: str, count: int, errors: list) -> None:
+        failures = {}
+        for item, message in errors:
+            failures.setdefault(message, []).append(item[0])
+        for message, paths in failures.items():
+            examples = ", ".join(f"'{path}'" for path in paths[:3])
+            if len(paths) > 3:
+                examples += f" and {len(paths) - 3} more"
+            self.print_error(f"{message}: {examples}")
+        self.set_result({"Entries": count, "Failed": len(errors)})
+        if len(errors) > 0:
+            self.print_error(f"{len(errors)} of {count} failed")
+            return
+        self.print_success(f"{verb} {count} {'entry' if count == 1 else 'entries'}.")
+
+    # rm and rmdir: delete every path given, wildcards expanded; -n only lists what would be deleted
+    def delete_many(self, request: str) -> None:
+        args = [arg for arg in self.args if arg != "-n"]
+        if len(args) == 0:
+            self.print_error("you need to provide an argument")
+            return
+        if (paths := self.expand_paths(args)) is None:
+            return
+        if "-n" in self.args:
+            for path in paths:
+                print(f"would delete '{path}'")
+            return
+        if len(paths) == 1 and paths[0] == self.abspath(args[0]):
+            data = self.request(request, paths[0])
+            self.invalidate(paths[0], removed=data["ErrorCode"] == 0)
+            self.set_result(None, data)
+            if data["ErrorCode"] != 0:
+                self.print_error(data["ErrorMessage"])
+                return
+            self.print_success(f"Deleted '{args[0]}'.")
+            return
+        errors = self.request_many(request, [(path,) for path in paths])
+        failed = {item[0] for item, _ in errors}
+        for path in paths:
+            self.invalidate(path, removed=path not in failed)
+        self.print_bulk_summary("Deleted", len(paths), errors)
+
+    # cp, mv and their folder variants: `source destin` is passed to the server as it is, several sources,
+    # wildcards or a trailing slash on the destination copy or move every source into an existing folder;
+    # -n only lists what would be done
+    def copy_many(self, request: str, verb: str, past: str) -> None:
+        args = [arg for arg in self.args if arg != "-n"]
+        if len(args) < 2:
+            self.print_error("you need to provide a source and a destination")
+            return
+        destin = self.abspath(args[-1])
+        if (sources := self.expand_paths(args[:-1])) is None:
+            return
+        into = len(sources) > 1 or args[-1].endswith("/") or sources[0] != self.abspath(args[0])
+        if into and self.info(destin, cached=False).get("Type") != "d":
+            self.print_error(f"'{args[-1]}' is not a folder")
+            return
+        items = [(source, self.join_path(destin, source.rstrip("/").split("/")[-1]) if into else destin) for source in sources]
+        if "-n" in self.args:
+            for source, target in items:
+                print(f"would {verb} '{source}' to '{target}'")
+            return
+        if len(items) == 1:
+            data = self.request(request, *items[0])
+            self.update_copied(request, items, set() if data["ErrorCode"] == 0 else {items[0][0]})
+            self.set_result(None, data)
+            if data["ErrorCode"] != 0:
+                self.print_error(data["ErrorMessage"])
+                return
+            self.print_success(f"'{args[0] if sources[0] == self.abspath(args[0]) else sources[0]}' {past.lower()} to "
+                               f"'{items[0][1] if into else args[-1]}'.")
+            return
+        errors = self.request_many(request, items)
+        self.update_copied(request, items, {item[0] for item, _ in errors})
+        self.print_bulk_summary(past, len(items), errors)
+
+    # invalidate the sources and targets of copied or moved items ((source, target) pairs): targets are
+    # added to the index, the sources of moves leave it; failed holds the sources that were not copied
+    def update_copied(self, request: str, items: list, failed: set) -> None:
+        for source, target in items:
+            self.invalidate(target)
+            if request in ("rfap_file_move", "rfap_directory_move"):
+                self.invalidate(source, removed=source not in failed)
+            if source not in failed:
+                self.add_to_index(target, request.startswith("rfap_directory_"))
+
+    def print_transfer_summary(self, count: int, errors: list, size: int, seconds: float) -> None:
+        for error in errors:
+            self.print_error(error)
+        rate = size / seconds / 1024 / 1024 if seconds > 0 else 0
+        message = f"{count - len(errors)}/{count} files, {size} bytes in {seconds:.2f}s ({rate:.2f} MiB/s)"
+        self.set_result({"Files": count, "Failed": len(errors), "Bytes": size, "Seconds": round(seconds, 6)})
+        if len(errors) > 0:
+            self.print_error(f"{len(errors)} transfers failed; {message}")
+            return
+        self.print_success(f"Transferred {message}.")
+
+    def begin_progress(self, total: int = None) -> None:
+        self.progress = {"Done": 0, "Total": total, "Started": time.monotonic(), "Shown": 0.0}
+
+    def add_progress(self, count: int) -> None:
+        if self.job is not None:
+            self.job.add_bytes(count)
+            return
+        if self.progress is None or not self.interactive or not self.settings["Progress"] or self.json_output():
+            return
+        with self.progress_lock:
+            self.progress["Done"] += count
+            now = time.monotonic()
+            if now - self.progress["Shown"] < 0.1:
+                return
+            self.progress["Shown"] = now
+            done, total = self.progress["Done"], self.progress["Total"]
+            rate = done / (now - self.progress["Started"]) / 1024 / 1024
+            percent = f" {done / total * 100:5.1f}%" if total else ""
+            sys.stderr.write(f"\r{done / 1024 / 1024:.2f} MiB{percent} {rate:.2f} MiB/s\033[K")
+            sys.stderr.flush()
+
+    def end_progress(self) -> None:
+        if self.progress is not None and self.progress["Shown"] > 0:
+            sys.stderr.write("\r\033[K")
+            sys.stderr.flush()
+        self.progress = None
+
+    def check_killed(self) -> None:
+        if self.job is not None and self.job.killed.is_set():
+            raise JobKilled("killed")
+
+    # run the current command on a copy of the app in a background thread
+    def start_job(self) -> None:
+        number = self.jobs[-1].number + 1 if len(self.jobs) > 0 else 1
+        job = Job(number, " ".join((self.cmd,) + self.args), self.line_number)
+        job_app = copy.copy(self)
+        job_app.job = job
+        job.thread = threading.Thread(target=job_app.run_job, daemon=True)
+        self.jobs.append(job)
+        job.thread.start()
+        self.set_result({"Job": job.number})
+        self.log(f"[{job.number}] {job.command}")
+
+    def run_job(self) -> None:
+        try:
+            self.job.status = "done" if self.execute() else "failed"
+        except JobKilled:
+            self.job.status = "killed"
+        except Exception as e:
+            self.job.messages.append((True, f"{self.cmd}: {e}"))
+            self.job.status = "failed"
+        self.job.finished = time.monotonic()
+
+    def format_job(self, job: Job) -> str:
+        return f"[{job.number}] {job.status:8} {job.bytes_done / 1024 / 1024:9.2f} MiB " \
+            f"{job.rate() / 1024 / 1024:7.2f} MiB/s {job.elapsed():7.1f}s  {job.command}"
+
+    # print the output of finished jobs and forget them, returns False if one of them failed
+    def report_jobs(self) -> bool:
+        ok = True
+        for job in [job for job in self.jobs if job.finished is not None]:
+            self.jobs.remove(job)
+            line_number, self.line_number = self.line_number, job.line_number
+            for is_error, message in job.messages:
+                if is_error:
+                    self.print_error(f"[{job.number}] {message}")
+                else:
+                    self.log(f"[{job.number}] {message}")
+            self.line_number = line_number
+            self.log(self.format_job(job))
+            ok = ok and job.status == "done"
+        return ok
+
+    def find_jobs(self) -> list:
+        if len(self.args) == 0:
+            return list(self.jobs)
+        jobs = [job for job in self.jobs if str(job.number) in [a.lstrip("%") for a in self.args]]
+        if len(jobs) == 0:
+            self.print_error(f"no such job: {' '.join(self.args)}")
+        return jobs
+
+    # sha256 of a local file and of each of its SyncBlockSize blocks
+    def hash_file(self, path: str) -> tuple:
+        block_size = int(self.settings["SyncBlockSize"])
+        digest, blocks = hashlib.sha256(), []
+        buffer = bytearray(block_size)
+        with open(path, "rb") as f, memoryview(buffer) as view:
+            while (count := f.readinto(buffer)) > 0:
+                digest.update(view[:count])
+                blocks.append(hashlib.sha256(view[:count]).hexdigest())
+        return digest.hexdigest(), blocks
+
+    def hash_content(self, content) -> tuple:
+        block_size = int(self.settings["SyncBlockSize"])
+        content = memoryview(content)
+        blocks = [hashlib.sha256(content[offset:offset + block_size]).hexdigest()
+                  for offset in range(0, len(content), block_size)]
+        return hashlib.sha256(content).hexdigest(), blocks
+
+    # the sync manifest of a local folder: relative path -> size, mtimes and content hashes
+    # of every file as of the last sync
+    def load_manifest(self, directory: str) -> dict:
+        return self.load_checkpoint(os.path.join(directory, self.SYNC_MANIFEST)) or {}
+
+    def store_manifest(self, directory: str, manifest: dict) -> None:
+        self.store_checkpoint(os.path.join(directory, self.SYNC_MANIFEST), manifest)
+
+    def is_sync_internal(self, name: str) -> bool:
+        return name == self.SYNC_MANIFEST or name.endswith(".rfap-part")
+
+    # upload the files below local whose content differs from the remote copy recorded in the manifest
+    def sync_up(self, local: str, remote: str, manifest: dict) -> tuple:
+        if (items := self.prepare_upload(local, remote)) is None:
+            return None, 0, 0, 0
+        items = [item for item in items if not self.is_sync_internal(os.path.basename(item[0]))]
+        if (walked := self.walk_remote(remote, cached=False)) is None:
+            return None, 0, 0, 0
+        remote_files = dict(walked[1])
+        changed = []
+        for source, destin in items:
+            relative = os.path.relpath(source, local).replace(os.sep, "/")
+            stat = os.stat(source)
+            entry = manifest.get(relative, {})
+            metadata = remote_files.get(destin, {})
+            remote_unchanged = metadata.get("Size") == entry.get("RemoteSize") and metadata.get("Modified") is not None \
+                and metadata.get("Modified") == entry.get("RemoteModified")
+            if entry.get("Size") == stat.st_size and entry.get("LocalModified") == stat.st_mtime and remote_unchanged:
+                continue
+            digest, blocks = self.hash_file(source)
+            if digest == entry.get("Hash") and remote_unchanged:
+                entry["LocalModified"] = stat.st_mtime
+                continue
+            changed.append((source, destin, relative, stat, digest, blocks))
+
+        def upload(client, item):
+            source, destin, relative, stat, digest, blocks = item
+            metadata = self.upload(source, destin, client=client)
+            if metadata["ErrorCode"] == 0:
+                manifest[relative] = {"Size": stat.st_size, "LocalModified": stat.st_mtime,
+                                      "RemoteSize": metadata.get("Size"), "RemoteModified": metadata.get("Modified"),
+                                      "Hash": digest, "Blocks": blocks}
+            return metadata
+        size = sum(item[3].st_size for item in changed)
+        self.begin_progress(size)
+        try:
+            errors = self.transfer_many(upload, changed)
+        finally:
+            self.end_progress()
+        return errors, len(changed), len(items), size
+
+    # download the remote files below remote that changed since the last sync,
+    # rewriting only the blocks of the local copy whose hash differs
+    def sync_down(self, remote: str, local: str, manifest: dict) -> tuple:
+        if (walked := self.walk_remote(remote, cached=False)) is None:
+            return None, 0, 0, 0
+        directories, files = walked
+        for directory in directories:
+            os.makedirs(os.path.join(local, os.path.relpath(directory, remote)), exist_ok=True)
+        files = [(path, metadata) for path, metadata in files if not self.is_sync_internal(path.split("/")[-1])]
+        changed = []
+        for path, metadata in files:
+            relative = os.path.relpath(path, remote)
+            destin = os.path.join(local, relative)
+            entry = manifest.get(relative.replace(os.sep, "/"), {})
+            local_unchanged = os.path.exists(destin) and entry.get("Size") == os.path.getsize(destin) \
+                and entry.get("LocalModified") == os.path.getmtime(destin)
+            if local_unchanged and metadata.get("Modified") is not None \
+                    and metadata.get("Modified") == entry.get("RemoteModified") and metadata.get("Size") == entry.get("RemoteSize"):
+                continue
+            changed.append((path, destin, relative.replace(os.sep, "/"), entry if local_unchanged else {}, metadata))
+
+        def download(client, item):
+            path, destin, relative, entry, remote_metadata = item
+            if len(entry.get("Blocks", [])) == 0:
+                metadata = self.download(path, destin, client=client)
+                if metadata["ErrorCode"] == 0:
+                    digest, blocks = self.hash_file(destin)
+            else:
+                metadata, content = self.fetch_file(path, client=client)
+                if metadata["ErrorCode"] == 0:
+                    digest, blocks = self.write_changed_blocks(destin, content, entry["Blocks"])
+            if metadata["ErrorCode"] == 0:
+                stat = os.stat(destin)
+                manifest[relative] = {"Size": stat.st_size, "LocalModified": stat.st_mtime,
+                                      "RemoteSize": remote_metadata.get("Size"), "RemoteModified": remote_metadata.get("Modified"),
+                                      "Hash": digest, "Blocks": blocks}
+            return metadata
+        size = sum(item[4].get("Size", 0) for item in changed)
+        self.begin_progress(size)
+        try:
+            errors = self.transfer_many(download, changed)
+        finally:
+            self.end_progress()
+        return errors, len(changed), len(files), size
+
+    # rewrite the blocks of destin that differ from content, returns the new hashes
+    def write_changed_blocks(self, destin: str, content, old_blocks: list) -> tuple:
+        block_size = int(self.settings["SyncBlockSize"])
+        digest, blocks = self.hash_content(content)
+        content = memoryview(content)
+        with open(destin, "r+b") as f:
+            for i, block in enumerate(blocks):
+                if i < len(old_blocks) and old_blocks[i] == block:
+                    continue
+                f.seek(i * block_size)
+                f.write(content[i * block_size:(i + 1) * block_size])
+                self.add_progress(min(block_size, len(content) - i * block_size))
+            f.truncate(len(content))
+        return digest, blocks
+
+    # open a remote file for the line based commands, None if it cannot be shown
+    def open_text_file(self, path: str):
+        remote_file = RemoteFile(self, path)
+        metadata = remote_file.open()
+        if metadata["ErrorCode"] != 0:
+            self.print_error(metadata["ErrorMessage"])
+            return None
+        if not remote_file.file_type.startswith("text/"):
+            print(f"{self.style_fg.MAGENTA}{path}: binary file ({remote_file.file_type}), not shown.{self.style.RESET_ALL}")
+            return None
+        return remote_file
+
+    # mark output that did not end with a newline
+    def end_output(self, last_line: str) -> None:
+        if not last_line.endswith("\n") and self.interactive and not self.json_output():
+            sys.stdout.write(f"{self.style_fg.BLACK}{self.style_bg.WHITE}%{self.style.RESET_ALL}\n")
+
+    # "10k", "+2M", "-1G": returns the comparison sign ("+", "-" or "") and the size in bytes
+    def parse_size(self, text: str) -> tuple:
+        if (match := re.fullmatch(r"([+-]?)(\d+)([kKMG]?)", text)) is None:
+            raise ValueError(f"invalid size '{text}'")
+        sign, number, unit = match.groups()
+        return sign, int(number) * 1024 ** " kMG".index(unit.replace("K", "k") or " ")
+
+    def human_size(self, size: int) -> str:
+        for unit in ("", "K", "M", "G", "T"):
+            if size < 1024 or unit == "T":
+                break
+            size /= 1024
+        return f"{size:.0f}{unit}" if unit == "" else f"{size:.1f}{unit}"
+
+    # split "-n 20", "-n20" or "-20" off the arguments, returns (count, remaining arguments)
+    def parse_count(self, args: tuple, default: int) -> tuple:
+        count, rest, args = default, [], list(args)
+        while len(args) > 0:
+            arg = args.pop(0)
+            if arg == "-n" and len(args) > 0:
+                arg = "-n" + args.pop(0)
+            if re.fullmatch(r"-n?\d+", arg):
+                count = int(arg.lstrip("-n"))
+                continue
+            rest.append(arg)
+        return count, tuple(rest)
+
+    # the whole content of a remote file, from the content cache if its size and mtime still match
+    def fetch_file(self, path: str, info: dict = None, client=None) -> tuple:
+        if not self.content_cache.enabled():
+            return self.read_range(path, client=client)
+        if info is None:
+            info = self.info(path, cached=False, client=client)
+        if info["ErrorCode"] == 0 and (content := self.content_cache.get(path, info)) is not None:
+            return info, memoryview(content)
+        metadata, content = self.read_range(path, client=client)
+        if metadata["ErrorCode"] == 0:
+            self.content_cache.put(path, metadata if metadata.get("Modified") is not None else info, content)
+        return metadata, content
+
+    # librfap 0.3.0 has no ranged read, so this fetches the whole file and slices it;
+    # callers still only ask for the bytes they are missing
+    def read_range(self, path: str, offset: int = 0, length: int = None, client=None) -> tuple:
+        metadata, content = self.request("rfap_file_read", path, client=client)
+        if metadata["ErrorCode"] != 0:
+            return metadata, b""
+        end = len(content) if length is None else offset + length
+        return metadata, memoryview(content)[offset:end]
+
+    def load_checkpoint(self, path: str):
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def store_checkpoint(self, path: str, checkpoint: dict) -> None:
+        with open(path, "w") as f:
+            json.dump(checkpoint, f)
+
+    def remove_checkpoint(self, path: str) -> None:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
+    # upload checkpoints live in the cache dir, so that sources in read-only folders can be uploaded
+    def upload_checkpoint(self, source: str, destin: str) -> str:
+        directory = os.path.join(self.cache_dir, "checkpoints")
+        os.makedirs(directory, exist_ok=True)
+        key = f"{self.settings['Server']}:{self.settings['Port']}:{os.path.abspath(source)}:{destin}"
+        return os.path.join(directory, hashlib.sha256(key.encode()).hexdigest() + ".json")
+
+    def integrity_error(self, path: str, message: str) -> dict:
+        return {"ErrorCode": 1, "ErrorMessage": f"integrity check of '{path}' failed: {message}", "Path": path}
+
+    # download remote into destin.rfap-part (preallocated to its final size) in ChunkSize pieces and rename
+    # it into place once its size matches the remote file; as librfap 0.3.0 has no ranged read, an
+    # interrupted save starts over instead of keeping a checkpoint that would not save any traffic
+    def download(self, remote: str, destin: str, client=None) -> dict:
+        info = self.info(remote, cached=False, client=client)
+        if info["ErrorCode"] != 0:
+            return info
+        part = destin + ".rfap-part"
+        metadata, content = self.fetch_file(remote, info, client=client)
+        if metadata["ErrorCode"] != 0:
+            return metadata
+        content = memoryview(content)
+        total = len(content)
+        if info.get("Size") is not None and total != info["Size"]:
+            return self.integrity_error(remote, f"received {total} of {info['Size']} bytes")
+        if None not in (metadata.get("Modified"), info.get("Modified")) and metadata["Modified"] != info["Modified"]:
+            return self.integrity_error(remote, "the file changed during the transfer")
+        chunk_size = int(self.settings["ChunkSize"])
+        with open(part, "wb") as f:
+            if total > 0 and hasattr(os, "posix_fallocate"):
+                try:
+                    os.posix_fallocate(f.fileno(), 0, total)
+                except OSError:
+                    pass
+            for offset in range(0, total, chunk_size):
+                self.check_killed()
+                f.write(content[offset:offset + chunk_size])
+                self.add_progress(min(chunk_size, total - offset))
+            f.truncate(total)
+            f.flush()
+            os.fsync(f.fileno())
+        if (size := os.path.getsize(part)) != total:
+            return self.integrity_error(remote, f"wrote {size} of {total} bytes")
+        os.replace(part, destin)
+        return metadata
+
+    # read-only view of a local file's pages; slices of it are passed on without copying them,
+    # and the mapping is dropped again when the block ends
+    @contextlib.contextmanager
+    def map_file(self, path: str):
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                yield b""
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if hasattr(mmap, "MADV_SEQUENTIAL"):
+                    mapped.madvise(mmap.MADV_SEQUENTIAL)
+                view = memoryview(mapped)
+                try:
+                    yield view
+                finally:
+                    view.release()
+
+    # write source to remote, keeping a checkpoint in the cache dir while the request is in flight, which
+    # is only left behind if the upload is interrupted; if a retry finds that the interrupted attempt
+    # already reached the server (same size, new mtime), the transfer is skipped. Returns the rfap_info
+    # of the written file after checking its size
+    def upload(self, source: str, destin: str, client=None) -> dict:
+        stat = os.stat(source)
+        checkpoint_file = self.upload_checkpoint(source, destin)
+        with self.map_file(source) as content:
+            written = len(content)
+            remote = self.info(destin, cached=False, client=client)
+            checkpoint = self.load_checkpoint(checkpoint_file)
+            if checkpoint is not None and remote["ErrorCode"] == 0 \
+                    and checkpoint["Remote"] == destin and checkpoint["Size"] == stat.st_size \
+                    and checkpoint["LocalModified"] == stat.st_mtime and remote.get("Size") == checkpoint.get("WrittenSize") \
+                    and remote.get("Modified") != checkpoint["RemoteModified"]:
+                self.log(f"'{destin}' was already written by the interrupted upload, skipping...")
+                self.remove_checkpoint(checkpoint_file)
+                return remote
+            self.store_checkpoint(checkpoint_file, {
+                "Remote": destin,
+                "Size": stat.st_size,
+                "LocalModified": stat.st_mtime,
+                "WrittenSize": written,
+                "RemoteModified": remote.get("Modified") if remote["ErrorCode"] == 0 else None
+                })
+            metadata = self.request("rfap_file_write", destin, content, client=client)
+            self.invalidate(destin)
+        self.remove_checkpoint(checkpoint_file)
+        if metadata["ErrorCode"] != 0:
+            return metadata
+        self.add_progress(stat.st_size)
+        metadata = self.info(destin, cached=False, client=client)
+        if metadata["ErrorCode"] == 0 and metadata.get("Size") is not None and metadata["Size"] != written:
+            return self.integrity_error(destin, f"the server has {metadata['Size']} of {written} bytes")
+        return metadata
+
     def built_in_editor(self):
         data = []
         i = 1
@@ -182,20 +1893,27 @@ class RfapCliApp:
         except IndexError:
             self.print_error("you need to provide an argument")
             return
-        self.socket_lock.acquire()
-        metadata, content = self.client.rfap_file_read(argument)
-        self.time_left = 60
-        self.socket_lock.release()
-        if metadata["ErrorCode"] != 0:
-            self.print_error(metadata["ErrorMessage"])
+        if (remote_file := self.open_text_file(argument)) is None:
             return
-        if not metadata["FileType"].startswith("text/"):
-            print(f"{self.style_fg.MAGENTA}{argument}: binary file ({metadata['FileType']}), not shown.{self.style.RESET_ALL}")
+        line = "\n"
+        for line in remote_file.lines():
+            sys.stdout.write(line)
+        self.end_output(line)
+
+    def cmd_cache(self):
+        if len(self.args) > 0 and self.args[0] == "clear":
+            self.cache.clear()
+            self.content_cache.clear()
+            self.print_success("cache cleared")
             return
-        content_string = content.decode("utf-8")
-        if not content_string.endswith("\n"):
-            content_string += f"{self.style_fg.BLACK}{self.style_bg.WHITE}%{self.style.RESET_ALL}\n"
-        sys.stdout.write(content_string)
+        lookups = self.cache.hits + self.cache.misses
+        print(f"metadata entries: {len(self.cache.entries)}/{self.settings['CacheSize']}, ttl: {self.settings['CacheTTL']}s")
+        print(f"hits: {self.cache.hits}, misses: {self.cache.misses}, hit rate: {(self.cache.hits / lookups * 100) if lookups else 0:.1f}%")
+        size = 0
+        if os.path.isdir(self.content_cache.directory):
+            size = sum(entry.stat().st_size for entry in os.scandir(self.content_cache.directory))
+        print(f"content cache {self.content_cache.directory}: {size / 1024 / 1024:.1f}/{int(self.settings['ContentCacheSize']) / 1024 / 1024:.1f} MiB")
+        print(f"hits: {self.content_cache.hits}, misses: {self.content_cache.misses}")
 
     def cmd_cd(self):
         try:
@@ -205,10 +1923,7 @@ class RfapCliApp:
         if argument == self.pwd:
             print(f"{self.style_fg.CYAN}{self.pwd}{self.style.RESET_ALL}")
             return
-        self.socket_lock.acquire()
-        metadata = self.client.rfap_info(argument)
-        self.time_left = 60
-        self.socket_lock.release()
+        metadata = self.info(argument)
         if metadata["ErrorCode"] != 0:
             self.print_error(f"cannot cd to '{argument}': {metadata['ErrorMessage']}")
             return
@@ -216,10 +1931,14 @@ class RfapCliApp:
             self.print_error(f"cannot cd to '{argument}': not a directory")
             return
         self.pwd = argument
+        self.prefetch(argument)
         print(argument)
 
     def cmd_cfg(self):
         if len(self.args) == 0:
+            if self.json_output():
+                self.set_result(self.settings)
+                return
             pprint.pprint(self.settings)
             return
         try:
@@ -243,48 +1962,22 @@ class RfapCliApp:
         self.print_error(f"clear command not available in {os.name} operating system")
 
     def cmd_copy(self):
-        try:
-            source = self.abspath(self.args[0])
-            destin = self.abspath(self.args[1])
-        except IndexError:
-            self.print_error(f"you need to provide a source and a destination")
-            return
-        self.socket_lock.acquire()
-        data = self.client.rfap_file_copy(source, destin)
-        self.time_left = 60
-        self.socket_lock.release()
-        if data["ErrorCode"] != 0:
-            self.print_error(data["ErrorMessage"])
-            return
-        self.print_success(f"'{self.args[0]}' copied to '{self.args[1]}'.")
+        self.copy_many("rfap_file_copy", "copy", "Copied")
 
     def cmd_copydir(self):
-        try:
-            source = self.abspath(self.args[0])
-            destin = self.abspath(self.args[1])
-        except IndexError:
-            self.print_error(f"you need to provide a source and a destination")
-            return
-        self.socket_lock.acquire()
-        data = self.client.rfap_directory_copy(source, destin)
-        self.time_left = 60
-        self.socket_lock.release()
-        if data["ErrorCode"] != 0:
-            self.print_error(data["ErrorMessage"])
-            return
-        self.print_success(f"'{self.args[0]}' copied to '{self.args[1]}'.")
+        self.copy_many("rfap_directory_copy", "copy", "Copied")
 
     def cmd_edit(self):
         try:
             argument = self.abspath(self.args[0])
         except IndexError:
-            self.print_error(f"you need to provide a file to edit")
+            self.print_error("you need to provide a file to edit")
             return
         if self.settings["Editor"] == "[built-in]":
             content = self.built_in_editor()
         else:
             print("loading file content...")
-            metadata, content = self.client.rfap_file_read(argument)
+            metadata, content = self.fetch_file(argument)
             with open(self.settings["Tempfile"], "wb") as f:
                 f.write(content)
             content = self.external_editor()
@@ -292,52 +1985,257 @@ class RfapCliApp:
         if content is None:
             self.print_error("writing to file aborted")
             return
-        self.socket_lock.acquire()
-        metadata = self.client.rfap_file_write(argument, content)
-        self.time_left = 60
-        self.socket_lock.release()
+        metadata = self.request("rfap_file_write", argument, content)
+        self.invalidate(argument)
+        self.set_result(None, metadata)
         if metadata["ErrorCode"] != 0:
             self.print_error(metadata["ErrorMessage"])
             return
+        self.add_to_index(argument, False)
         self.print_success(f"'{self.args[0]}' updated.")
 
+    def cmd_du(self):
+        flags = [arg for arg in self.args if arg in ("-s", "-h")]
+        args = [arg for arg in self.args if arg not in flags]
+        depth = 0 if "-s" in flags else None
+        if len(args) > 1 and args[0] == "-d":
+            try:
+                depth = int(args[1])
+            except ValueError:
+                self.print_error(f"invalid depth '{args[1]}'")
+                return
+            args = args[2:]
+        root = "/" + "/".join(self.split_path(self.abspath(args[0]) if len(args) > 0 else self.pwd))
+        totals = {}
+        self.begin_progress()
+        try:
+            for path, level, metadata in self.crawl(root):
+                if metadata.get("Type") == "d":
+                    totals.setdefault(path, 0)
+                    continue
+                size = metadata.get("Size") or 0
+                self.add_progress(size)
+                if level == 0:
+                    totals[path] = size
+                while path != root:
+                    path = self.parent_dir(path)
+                    totals[path] = totals.get(path, 0) + size
+        finally:
+            self.end_progress()
+        root_depth = len(self.split_path(root))
+        if self.json_output():
+            self.set_result({path: size for path, size in totals.items()
+                             if depth is None or len(self.split_path(path)) - root_depth <= depth})
+            return
+        for path in sorted(totals, key=lambda path: self.split_path(path) + ["\uffff"]):
+            if depth is not None and len(self.split_path(path)) - root_depth > depth:
+                continue
+            print(f"{self.human_size(totals[path]) if '-h' in flags else totals[path]}\t{path}")
+
+    def cmd_find(self):
+        args, root = list(self.args), self.pwd
+        if len(args) > 0 and not args[0].startswith("-"):
+            root = self.abspath(args.pop(0))
+        name, name_flags, kind, sizes, min_depth, max_depth = None, 0, None, [], 0, None
+        try:
+            while len(args) > 0:
+                option = args.pop(0)
+                if len(args) == 0:
+                    raise ValueError(f"missing value for '{option}'")
+                value = args.pop(0)
+                match option:
+                    case "-name" | "-iname":
+                        name, name_flags = fnmatch.translate(value), re.IGNORECASE if option == "-iname" else 0
+                    case "-type":
+                        if value not in ("f", "d"):
+                            raise ValueError(f"invalid type '{value}', must be f or d")
+                        kind = value
+                    case "-size":
+                        sizes.append(self.parse_size(value))
+                    case "-mindepth" | "-maxdepth":
+                        if option == "-mindepth":
+                            min_depth = int(value)
+                        else:
+                            max_depth = int(value)
+                    case _:
+                        raise ValueError(f"unknown option '{option}'")
+        except ValueError as e:
+            self.print_error(str(e))
+            return
+        pattern = re.compile(name, name_flags) if name is not None else None
+        count = 0
+        for path, depth, metadata in self.crawl(root, max_depth):
+            if depth < min_depth or (kind is not None and metadata.get("Type") != kind):
+                continue
+            if pattern is not None and pattern.match(path.rstrip("/").split("/")[-1] or "/") is None:
+                continue
+            size = metadata.get("Size") or 0
+            if not all(size > limit if sign == "+" else size < limit if sign == "-" else size == limit for sign, limit in sizes):
+                continue
+            count += 1
+            if self.json_output():
+                self.emit_record({"Path": path, "Depth": depth, "Metadata": metadata})
+                continue
+            print(path)
+        if self.json_output():
+            self.set_result({"Root": root, "Count": count})
+
+    def cmd_grep(self):
+        flags = [arg for arg in self.args if arg in ("-i", "-n", "-c")]
+        args = [arg for arg in self.args if arg not in flags]
+        try:
+            pattern = re.compile(args[0], re.IGNORECASE if "-i" in flags else 0)
+            paths = [self.abspath(arg) for arg in args[1:]] or [None]
+        except IndexError:
+            self.print_error("you need to provide a pattern and a file")
+            return
+        except re.error as e:
+            self.print_error(f"invalid pattern: {e}")
+            return
+        if paths == [None]:
+            self.print_error("you need to provide a pattern and a file")
+            return
+        for path in paths:
+            if (remote_file := self.open_text_file(path)) is None:
+                continue
+            prefix = f"{self.style_fg.MAGENTA}{path}{self.style.RESET_ALL}:" if len(paths) > 1 else ""
+            matches = 0
+            for number, line in enumerate(remote_file.lines(), 1):
+                if pattern.search(line) is None:
+                    continue
+                matches += 1
+                if "-c" in flags:
+                    continue
+                line_number = f"{self.style_fg.GREEN}{number}{self.style.RESET_ALL}:" if "-n" in flags else ""
+                sys.stdout.write(prefix + line_number + line if line.endswith("\n") else prefix + line_number + line + "\n")
+            if "-c" in flags:
+                print(f"{prefix}{matches}")
+
+    def cmd_head(self):
+        count, args = self.parse_count(self.args, 10)
+        try:
+            argument = self.abspath(args[0])
+        except IndexError:
+            self.print_error("you need to provide a file")
+            return
+        if (remote_file := self.open_text_file(argument)) is None:
+            return
+        line = "\n"
+        for number, line in enumerate(remote_file.lines()):
+            if number >= count:
+                line = "\n"
+                break
+            sys.stdout.write(line)
+        self.end_output(line)
+
     def cmd_help(self):
         self.print_error("help is coming soon xD")
 
+    def cmd_index(self):
+        match self.args[0] if len(self.args) > 0 else "":
+            case "refresh":
+                root = self.abspath(self.args[1]) if len(self.args) > 1 else self.pwd
+                count = sum(1 for _ in self.crawl(root, cached=False))
+                self.index.save()
+                self.print_success(f"indexed {count} paths below '{root}'")
+            case "clear":
+                with self.index.lock:
+                    self.index.entries = []
+                    self.index.changed()
+                self.index.save()
+                self.print_success("index cleared")
+            case "":
+                size = os.path.getsize(self.index.file) if os.path.exists(self.index.file) else 0
+                print(f"{self.index.file}: {len(self.index.load())} paths, {size / 1024:.1f} KiB")
+            case _:
+                self.print_error("usage: index [refresh [folder] | clear]")
+
     def cmd_info(self):
+        paths = [self.abspath(arg) for arg in self.args] or [self.pwd]
+        infos = [self.info(paths[0])] if len(paths) == 1 else self.stat_many(paths)
+        for path, metadata in zip(paths, infos):
+            if self.json_output():
+                self.emit_record({"Path": path, "Metadata": metadata})
+            else:
+                pprint.pprint(metadata)
+            if metadata["ErrorCode"] != 0:
+                self.print_error(f"'{path}': {metadata['ErrorMessage']}")
+        if self.json_output():
+            self.set_result({"Count": len(paths)}, infos[0] if len(paths) == 1 else None)
+
+    def cmd_jobs(self):
+        if len(self.jobs) == 0:
+            self.log("no jobs")
+            return
+        for job in self.jobs:
+            print(self.format_job(job))
+
+    def cmd_kill(self):
+        if len(self.args) == 0:
+            self.print_error("you need to provide a job number")
+            return
+        for job in self.find_jobs():
+            job.killed.set()
+            self.log(f"[{job.number}] killing, stops after the current chunk or file")
+
+    def cmd_less(self):
         try:
             argument = self.abspath(self.args[0])
         except IndexError:
-            argument = self.pwd
-        self.socket_lock.acquire()
-        metadata = self.client.rfap_info(argument)
-        self.time_left = 60
-        self.socket_lock.release()
-        pprint.pprint(metadata)
+            self.print_error("you need to provide a file")
+            return
+        if (remote_file := self.open_text_file(argument)) is None:
+            return
+        page = shutil.get_terminal_size().lines - 1
+        line = "\n"
+        for number, line in enumerate(remote_file.lines(), 1):
+            sys.stdout.write(line)
+            if number % page == 0 and self.interactive and self.job is None and not self.json_output():
+                inp = input(f"{self.style_fg.BLACK}{self.style_bg.WHITE}-- {argument} line {number} "
+                            f"(enter: next page, q: quit) --{self.style.RESET_ALL}")
+                if inp in ("q", "Q"):
+                    return
+        self.end_output(line)
+
+    def cmd_locate(self):
+        flags = [arg for arg in self.args if arg == "-i"]
+        args = [arg for arg in self.args if arg not in flags]
+        if len(args) == 0:
+            self.print_error("you need to provide a pattern")
+            return
+        if not self.index.enabled():
+            self.print_error("the path index is disabled, set PathIndex to use locate")
+            return
+        for path in self.index.locate(args[0], "-i" in flags):
+            if self.json_output():
+                self.emit_record({"Path": path})
+                continue
+            print(path)
 
     def cmd_ls(self):
         try:
             argument = self.abspath(self.args[0])
         except IndexError:
             argument = self.pwd
-        self.socket_lock.acquire()
-        metadata, files = self.client.rfap_directory_read(argument)
-        self.time_left = 60
-        self.socket_lock.release()
+        metadata, files = self.directory_read(argument)
         if metadata["ErrorCode"] != 0:
+            self.set_result(None, metadata)
             self.print_error(metadata["ErrorMessage"])
             return
+        if self.json_output():
+            infos = self.stat_many([self.join_path(argument, f) for f in files]) if self.settings["ColoredLS"] else [None] * len(files)
+            for f, m in zip(files, infos):
+                self.emit_record({"Name": f, "Path": self.join_path(argument, f)} | ({"Metadata": m} if m is not None else {}))
+            self.set_result({"Path": argument, "Count": len(files)}, metadata)
+            return
         if not self.settings["ColoredLS"]:
             for f in files:
                 print(f)
             return
         regular_files = []
-        for f in files:
-            self.socket_lock.acquire()
-            m = self.client.rfap_info(argument + "/" + f)
-            self.time_left = 60
-            self.socket_lock.release()
-            if m["Type"] == "d":
+        infos = self.stat_many([self.join_path(argument, f) for f in files])
+        for f, m in zip(files, infos):
+            if m.get("Type") == "d":
                 print(f"{self.style_fg.BLUE}{f}/{self.style.RESET_ALL}")
             else:
                 regular_files.append(f)
@@ -345,36 +2243,35 @@ class RfapCliApp:
             print(f)
 
     def cmd_move(self):
-        try:
-            source = self.abspath(self.args[0])
-            destin = self.abspath(self.args[1])
-        except IndexError:
-            self.print_error("you need to provide a source and a destination")
-            return
-        self.socket_lock.acquire()
-        data = self.client.rfap_file_move(source, destin)
-        self.time_left = 60
-        self.socket_lock.release()
-        if data["ErrorCode"] != 0:
-            self.print_error(data["ErrorMessage"])
-            return
-        self.print_success(f"'{self.args[0]}' moved to '{self.args[1]}'.")
+        self.copy_many("rfap_file_move", "move", "Moved")
 
     def cmd_movedir(self):
+        self.copy_many("rfap_directory_move", "move", "Moved")
+
+    def cmd_mget(self):
         try:
             source = self.abspath(self.args[0])
-            destin = self.abspath(self.args[1])
+            destin = self.args[1]
         except IndexError:
-            self.print_error("you need to provide a source and a destination")
+            self.print_error("you need to provide a remote folder and a local destination")
             return
-        self.socket_lock.acquire()
-        data = self.client.rfap_directory_move(source, destin)
-        self.time_left = 60
-        self.socket_lock.release()
-        if data["ErrorCode"] != 0:
-            self.print_error(data["ErrorMessage"])
+        if os.path.exists(destin):
+            if not self.confirm(f"Warning: '{destin}' already exists. Merge into it"):
+                return
+        start = time.monotonic()
+        if (walked := self.walk_remote(source)) is None:
             return
-        self.print_success(f"'{self.args[0]}' moved to '{self.args[1]}'.")
+        directories, files = walked
+        for directory in directories:
+            os.makedirs(os.path.join(destin, os.path.relpath(directory, source)), exist_ok=True)
+        items = [(path, os.path.join(destin, os.path.relpath(path, source))) for path, _ in files]
+        size = sum(metadata.get("Size", 0) for _, metadata in files)
+        self.begin_progress(size)
+        try:
+            errors = self.transfer_many(lambda client, item: self.download(*item, client=client), items)
+        finally:
+            self.end_progress()
+        self.print_transfer_summary(len(items), errors, size, time.monotonic() - start)
 
     def cmd_mkdir(self):
         try:
@@ -382,73 +2279,199 @@ class RfapCliApp:
         except IndexError:
             self.print_error("you need to provide an argument")
             return
-        self.socket_lock.acquire()
-        data = self.client.rfap_directory_create(argument)
-        self.time_left = 60
-        self.socket_lock.release()
+        data = self.request("rfap_directory_create", argument)
+        self.invalidate(argument)
+        self.set_result(None, data)
         if data["ErrorCode"] != 0:
             self.print_error(data["ErrorMessage"])
             return
+        self.add_to_index(argument, True)
         self.print_success(f"Created '{argument}'.")
 
+    def cmd_mput(self):
+        try:
+            source = self.args[0]
+            destin = self.abspath(self.args[1])
+        except IndexError:
+            self.print_error("you need to provide a local folder and a remote destination")
+            return
+        if not os.path.isdir(source):
+            self.print_error(f"'{source}' is not a folder")
+            return
+        start = time.monotonic()
+        if (items := self.prepare_upload(source, destin)) is None:
+            return
+        size = sum(os.path.getsize(local) for local, _ in items)
+        self.begin_progress(size)
+        try:
+            errors = self.transfer_many(lambda client, item: self.upload(*item, client=client), items)
+        finally:
+            self.end_progress()
+        self.print_transfer_summary(len(items), errors, size, time.monotonic() - start)
+
     def cmd_ping(self):
-        self.socket_lock.acquire()
-        self.client.rfap_ping()
-        self.time_left = 60
-        self.socket_lock.release()
+        self.set_result(None, self.request("rfap_ping"))
         self.print_success("sent ping")
 
+    def cmd_health(self):
+        health = self.engine.health
+        if self.json_output():
+            self.set_result(health | {"Connections": len(self.engine.connections), "Workers": self.engine.size})
+            return
+        print(f"status: {'healthy' if health['Healthy'] else 'failing'}, connections: {len(self.engine.connections)}/{self.engine.size}")
+        print(f"connection errors: {health['Failures']}, reconnects: {health['Reconnects']}")
+        if health["LastError"] is not None:
+            print(f"last error: {health['LastError']} at {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(health['LastErrorTime']))}")
+
     def cmd_rm(self):
+        self.delete_many("rfap_file_delete")
+
+    def cmd_rmdir(self):
+        self.delete_many("rfap_directory_delete")
+
+    def cmd_save(self):
+        if len(self.args) < 2:
+            self.print_error("you need to provide a remote source and a local destination")
+            return
+        if (sources := self.expand_paths(self.args[:-1])) is None:
+            return
+        destin = self.args[-1]
+        if len(sources) > 1:
+            if not os.path.isdir(destin):
+                self.print_error(f"'{destin}' is not a local folder")
+                return
+            self.save_many([(source, os.path.join(destin, source.rstrip("/").split("/")[-1])) for source in sources])
+            return
+        argument = sources[0]
+        if os.path.isdir(destin):
+            destin = os.path.join(destin, argument.rstrip("/").split("/")[-1])
+        if os.path.exists(destin):
+            if not self.confirm(f"Warning: '{destin}' already exists. Overwrite"):
+                return
+        self.begin_progress()
         try:
-            argument = self.abspath(self.args[0])
-        except IndexError:
-            self.print_error("you need to provide an argument")
+            metadata = self.download(argument, destin)
+        except OSError as e:
+            self.print_error(f"saving '{argument}' failed: {e}")
             return
-        self.socket_lock.acquire()
-        data = self.client.rfap_file_delete(argument)
-        self.time_left = 60
-        self.socket_lock.release()
-        if data["ErrorCode"] != 0:
-            self.print_error(data["ErrorMessage"])
+        finally:
+            self.end_progress()
+        self.set_result(None, metadata)
+        if metadata["ErrorCode"] != 0:
+            self.print_error(metadata["ErrorMessage"])
             return
-        self.print_success(f"Deleted '{self.args[0]}'.")
+        self.print_success(f"Saved '{argument}' to '{destin}'.")
 
-    def cmd_rmdir(self):
+    # save several remote files at once, one per connection
+    def save_many(self, items: list) -> None:
+        if (existing := sum(1 for _, destin in items if os.path.exists(destin))) > 0:
+            if not self.confirm(f"Warning: {existing} of the files already exist. Overwrite"):
+                return
+        start = time.monotonic()
+        size = sum(metadata.get("Size") or 0 for metadata in self.stat_many([source for source, _ in items], cached=False))
+        self.begin_progress(size)
         try:
-            argument = self.abspath(self.args[0])
+            errors = self.transfer_many(lambda client, item: self.download(*item, client=client), items)
+        finally:
+            self.end_progress()
+        self.print_transfer_summary(len(items), errors, size, time.monotonic() - start)
+
+    def cmd_stats(self):
+        if len(self.args) > 0 and self.args[0] == "reset":
+            self.stats.reset()
+            self.print_success("statistics reset")
+            return
+        if self.json_output():
+            self.set_result(self.stats.summary())
+            return
+        print(f"{'request':24} {'count':>7} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'in MiB':>9} {'out MiB':>9} {'MiB/s':>7}")
+        for name, operation in self.stats.summary().items():
+            traffic = (operation["BytesIn"] + operation["BytesOut"]) / 1024 / 1024
+            rate = traffic / operation["Seconds"] if operation["Seconds"] > 0 else 0
+            print(f"{name:24} {operation['Count']:7} {sum(operation['Errors'].values()):6} "
+                  f"{operation['P50'] * 1000:8.1f} {operation['P95'] * 1000:8.1f} {operation['P99'] * 1000:8.1f} "
+                  f"{operation['BytesIn'] / 1024 / 1024:9.2f} {operation['BytesOut'] / 1024 / 1024:9.2f} {rate:7.2f}")
+
+    def cmd_sync(self):
+        try:
+            direction, source, destin = self.args[0], self.args[1], self.args[2]
         except IndexError:
-            self.print_error("you need to provide an argument")
+            direction = None
+        if direction not in ("up", "down"):
+            self.print_error("usage: sync up <local folder> <remote folder> | sync down <remote folder> <local folder>")
             return
-        self.socket_lock.acquire()
-        data = self.client.rfap_directory_delete(argument)
-        self.time_left = 60
-        self.socket_lock.release()
-        if data["ErrorCode"] != 0:
-            self.print_error(data["ErrorMessage"])
+        local = source if direction == "up" else destin
+        if direction == "up" and not os.path.isdir(local):
+            self.print_error(f"'{local}' is not a folder")
             return
-        self.print_success(f"Deleted '{self.args[0]}'.")
+        start = time.monotonic()
+        manifest = self.load_manifest(local) if os.path.isdir(local) else {}
+        if direction == "up":
+            errors, changed, total, size = self.sync_up(local, self.abspath(destin), manifest)
+        else:
+            errors, changed, total, size = self.sync_down(self.abspath(source), local, manifest)
+        if errors is None:
+            return
+        os.makedirs(local, exist_ok=True)
+        self.store_manifest(local, manifest)
+        self.log(f"{total - changed}/{total} files unchanged")
+        self.print_transfer_summary(changed, errors, size, time.monotonic() - start)
 
-    def cmd_save(self):
+    def cmd_tail(self):
+        count, args = self.parse_count(self.args, 10)
         try:
-            argument = self.abspath(self.args[0])
-            destin = self.args[1]
+            argument = self.abspath(args[0])
         except IndexError:
-            self.print_error("you need to provide a remote source and a local destination")
+            self.print_error("you need to provide a file")
             return
-        self.socket_lock.acquire()
-        metadata, content = self.client.rfap_file_read(argument)
-        self.time_left = 60
-        self.socket_lock.release()
-        if metadata["ErrorCode"] != 0:
-            self.print_error(metadata["ErrorMessage"])
+        if (remote_file := self.open_text_file(argument)) is None:
             return
-        if os.path.exists(destin):
-            if not self.confirm(f"Warning: '{destin}' already exists. Overwrite"):
+        # step backwards one ChunkSize window at a time until count lines are covered, counting the
+        # newlines of each new window only; the newline ending the last line does not start a line
+        chunk_size, size = int(self.settings["ChunkSize"]), remote_file.size()
+        start = size
+        newlines = -1 if size > 0 and bytes(remote_file.read(size - 1, 1)) == b"\n" else 0
+        while start > 0 and newlines <= count:
+            end, start = start, max(0, start - chunk_size)
+            newlines += bytes(remote_file.read(start, end - start)).count(b"\n")
+        lines = deque(remote_file.lines(start), maxlen=count)
+        line = "\n"
+        for line in lines:
+            sys.stdout.write(line)
+        self.end_output(line)
+
+    def cmd_tree(self):
+        args, depth = list(self.args), None
+        if len(args) > 1 and args[0] == "-L":
+            try:
+                depth = int(args[1])
+            except ValueError:
+                self.print_error(f"invalid depth '{args[1]}'")
                 return
-        f = open(destin, "wb")
-        f.write(content)
-        f.close()
-        self.print_success(f"Saved '{argument}' to '{destin}'.")
+            args = args[2:]
+        root = "/" + "/".join(self.split_path(self.abspath(args[0]) if len(args) > 0 else self.pwd))
+        children = {}
+        counts = {"d": 0, "f": 0}
+        found = False
+        for path, level, metadata in self.crawl(root, depth):
+            kind = "d" if metadata.get("Type") == "d" else "f"
+            if level > 0:
+                children.setdefault(self.parent_dir(path), []).append((path.split("/")[-1], kind))
+                counts[kind] += 1
+            found = True
+        if not found:
+            return
+        print(f"{self.style_fg.BLUE}{root}{self.style.RESET_ALL}")
+        def show(path, prefix):
+            entries = sorted(children.get(path, []))
+            for i, (name, kind) in enumerate(entries):
+                last = i == len(entries) - 1
+                label = f"{self.style_fg.BLUE}{name}/{self.style.RESET_ALL}" if kind == "d" else name
+                print(f"{prefix}{'└── ' if last else '├── '}{label}")
+                if kind == "d":
+                    show(self.join_path(path, name), prefix + ("    " if last else "│   "))
+        show(root, "")
+        print(f"\n{counts['d']} directories, {counts['f']} files")
 
     def cmd_touch(self):
         try:
@@ -456,105 +2479,320 @@ class RfapCliApp:
         except IndexError:
             self.print_error("you need to provide an argument")
             return
-        self.socket_lock.acquire()
-        data = self.client.rfap_file_create(argument)
-        self.time_left = 60
-        self.socket_lock.release()
+        data = self.request("rfap_file_create", argument)
+        self.invalidate(argument)
+        self.set_result(None, data)
         if data["ErrorCode"] != 0:
             self.print_error(data["ErrorMessage"])
             return
+        self.add_to_index(argument, False)
         self.print_success(f"Created '{argument}'.")
 
-    def cmd_upload(self):
+    def cmd_wait(self):
         try:
-            argument = self.args[0]
-            destin = self.abspath(self.args[1])
-        except IndexError:
+            for job in self.find_jobs():
+                while job.thread.is_alive():
+                    job.thread.join(0.5)
+        except KeyboardInterrupt:
+            self.log("")
+            return
+        if not self.report_jobs():
+            self.failed = True
+
+    def cmd_upload(self):
+        if len(self.args) < 2:
             self.print_error("you need to provide a local source and a remote destination")
             return
+        sources = []
+        for arg in self.args[:-1]:
+            if not any(c in arg for c in "*?[") or os.path.exists(arg):
+                sources.append(arg)
+                continue
+            if len(matches := sorted(glob.glob(arg))) == 0:
+                self.print_error(f"no match for '{arg}'")
+                return
+            if len(folders := [path for path in matches if os.path.isdir(path)]) > 0:
+                self.print_error(f"'{arg}' matches folders ({', '.join(folders)}), use mput to upload them")
+                return
+            sources += matches
+        destin = self.abspath(self.args[-1])
+        if len(sources) > 1 or self.args[-1].endswith("/") or self.info(destin, cached=False).get("Type") == "d":
+            if self.info(destin).get("Type") != "d":
+                self.print_error(f"'{self.args[-1]}' is not a folder")
+                return
+            self.upload_many([(source, self.join_path(destin, os.path.basename(source))) for source in sources])
+            return
+        argument = sources[0]
         try:
-            f = open(argument, "rb")
-            data = f.read()
-            f.close()
-        except Exception as e:
-            self.print_error(f"Error reading {argument}: {e}")
+            metadata = self.upload(argument, destin)
+        except OSError as e:
+            self.print_error(f"uploading '{argument}' failed: {e}")
             return
-        self.socket_lock.acquire()
-        metadata = self.client.rfap_file_write(destin, data)
-        self.time_left = 60
-        self.socket_lock.release()
+        self.set_result(None, metadata)
         if metadata["ErrorCode"] != 0:
             self.print_error(metadata["ErrorMessage"])
             return
         self.print_success(f"Uploaded '{argument}' to '{destin}'.")
 
+    # upload several local files at once, one per connection
+    def upload_many(self, items: list) -> None:
+        start = time.monotonic()
+        try:
+            size = sum(os.path.getsize(source) for source, _ in items)
+        except OSError as e:
+            self.print_error(str(e))
+            return
+        self.begin_progress(size)
+        try:
+            errors = self.transfer_many(lambda client, item: self.upload(*item, client=client), items)
+        finally:
+            self.end_progress()
+        self.print_transfer_summary(len(items), errors, size, time.monotonic() - start)
+
+    def execute(self) -> bool:
+        if not self.json_output() or self.cmd == "":
+            return self.run_command()
+        if not isinstance(sys.stdout, CapturedOutput):
+            sys.stdout = CapturedOutput(sys.stdout)
+        self.output = {"Result": None, "Metadata": None, "Messages": [], "Errors": []}
+        start = time.monotonic()
+        sys.stdout.begin()
+        try:
+            return self.run_command()
+        except Exception as e:
+            self.print_error(f"{self.cmd}: {e}")
+            raise
+        finally:
+            self.emit_result(sys.stdout.end(), time.monotonic() - start)
+            self.output = None
+
+    def run_command(self) -> bool:
+        self.failed = False
+        if len(self.args) > 0 and self.args[-1].endswith("&") and self.job is None:
+            self.args = self.args[:-1] + ((self.args[-1][:-1],) if self.args[-1] != "&" else ())
+            if self.cmd not in self.BACKGROUND_COMMANDS:
+                self.print_error(f"{self.cmd}: cannot run in the background")
+                return False
+            self.start_job()
+            return True
+        match self.cmd:
+            case "cache":
+                self.cmd_cache()
+            case "cat" | "read" | "print":
+                self.cmd_cat()
+            case "cd":
+                self.cmd_cd()
+            case "cfg" | "config" | "set":
+                self.cmd_cfg()
+            case "clear" | "cls":
+                self.cmd_clear()
+            case "copy" | "cp":
+                self.cmd_copy()
+            case "copydir" | "cpdir":
+                self.cmd_copydir()
+            case "debug" | "exec":
+                if not self.interactive:
+                    self.print_error("this command is not available in batch mode")
+                elif self.settings["Debug"]:
+                    exec(input(f"{self.style_fg.RED}exec> {self.style.RESET_ALL}"))
+                else:
+                    self.print_error("this command is only available in debug mode")
+            case "edit" | "write" | "v":
+                self.cmd_edit()
+            case "du":
+                self.cmd_du()
+            case "find":
+                self.cmd_find()
+            case "grep":
+                self.cmd_grep()
+            case "head":
+                self.cmd_head()
+            case "health":
+                self.cmd_health()
+            case "help":
+                self.cmd_help()
+            case "index":
+                self.cmd_index()
+            case "info":
+                self.cmd_info()
+            case "jobs":
+                self.cmd_jobs()
+            case "kill":
+                self.cmd_kill()
+            case "less" | "more":
+                self.cmd_less()
+            case "locate":
+                self.cmd_locate()
+            case "ls" | "list" | "dir":
+                self.cmd_ls()
+            case "mget" | "getdir":
+                self.cmd_mget()
+            case "mput" | "putdir":
+                self.cmd_mput()
+            case "mkdir" | "makedir":
+                self.cmd_mkdir()
+            case "move" | "mv" | "rename":
+                self.cmd_move()
+            case "movedir" | "mvdir":
+                self.cmd_movedir()
+            case "ping":
+                self.cmd_ping()
+            case "pwd":
+                print(self.pwd)
+            case "rm" | "remove" | "del" | "delete":
+                self.cmd_rm()
+            case "rmdir" | "deldir":
+                self.cmd_rmdir()
+            case "save" | "download" | "dl":
+                self.cmd_save()
+            case "stats":
+                self.cmd_stats()
+            case "sync":
+                self.cmd_sync()
+            case "tail":
+                self.cmd_tail()
+            case "tree":
+                self.cmd_tree()
+            case "touch" | "create":
+                self.cmd_touch()
+            case "upload":
+                self.cmd_upload()
+            case "wait" | "fg":
+                self.cmd_wait()
+            case "":
+                pass
+            case _:
+                self.print_error(f"{self.cmd}: command not found, type 'help' for help")
+        return not self.failed
+
     # mainloop
     def run(self):
-        while self.cmd not in ("exit", "quit", "disconnect", ":q"):
+        while self.cmd not in self.EXIT_COMMANDS:
             try:
-                match self.cmd:
-                    case "cat" | "read" | "print":
-                        self.cmd_cat()
-                    case "cd":
-                        self.cmd_cd()
-                    case "cfg" | "config" | "set":
-                        self.cmd_cfg()
-                    case "clear" | "cls":
-                        self.cmd_clear()
-                    case "copy" | "cp":
-                        self.cmd_copy()
-                    case "copydir" | "cpdir":
-                        self.cmd_copydir()
-                    case "debug" | "exec":
-                        if self.settings["Debug"]:
-                            exec(input(f"{self.style_fg.RED}exec> {self.style.RESET_ALL}"))
-                        else:
-                            self.print_error("this command is only available in debug mode")
-                    case "edit" | "write" | "v":
-                        self.cmd_edit()
-                    case "help":
-                        self.cmd_help()
-                    case "info":
-                        self.cmd_info()
-                    case "ls" | "list" | "dir":
-                        self.cmd_ls()
-                    case "mkdir" | "makedir":
-                        self.cmd_mkdir()
-                    case "move" | "mv" | "rename":
-                        self.cmd_move()
-                    case "movedir" | "mvdir":
-                        self.cmd_movedir()
-                    case "ping":
-                        self.cmd_ping()
-                    case "pwd":
-                        print(self.pwd)
-                    case "rm" | "remove" | "del" | "delete":
-                        self.cmd_rm()
-                    case "rmdir" | "deldir":
-                        self.cmd_rmdir()
-                    case "save" | "download" | "dl":
-                        self.cmd_save()
-                    case "touch" | "create":
-                        self.cmd_touch()
-                    case "upload":
-                        self.cmd_upload()
-                    case "":
-                        pass
-                    case _:
-                        self.print_error(f"{self.cmd}: command not found, type 'help' for help")
+                try:
+                    self.execute()
+                except (ConnectionError, EOFError) as e:
+                    self.print_error(f"{self.cmd}: connection failed: {e}")
+                except OSError as e:
+                    self.print_error(f"{self.cmd}: {e}")
+                self.report_jobs()
                 self.enter_cmd()
             except KeyboardInterrupt:
                 break
+        for job in self.jobs:
+            job.killed.set()
+        self.disconnect()
+
+    # run the commands of self.script (a file, or - for stdin) one after another over this connection
+    def run_batch(self) -> int:
+        try:
+            script = sys.stdin if self.script == "-" else open(self.script, "r")
+        except OSError as e:
+            self.print_error(f"cannot read script: {e}")
+            self.disconnect()
+            return self.EXIT_USAGE
+        status = self.EXIT_OK
+        with script:
+            for self.line_number, line in enumerate(script, 1):
+                inp = line.split()
+                if len(inp) == 0 or inp[0].startswith("#"):
+                    continue
+                self.cmd, self.args = inp[0], tuple(inp[1:])
+                if self.cmd in self.EXIT_COMMANDS:
+                    break
+                try:
+                    if self.execute():
+                        continue
+                except (ConnectionError, EOFError) as e:
+                    self.print_error(f"connection failed: {e}")
+                    status = self.EXIT_CONNECTION
+                    break
+                except Exception as e:
+                    self.print_error(f"{self.cmd}: {e}")
+                status = self.EXIT_FAILED
+                if not self.keep_going:
+                    break
+        self.args = ()
+        self.failed = False
+        self.cmd_wait()
+        if self.failed and status == self.EXIT_OK:
+            status = self.EXIT_FAILED
+        self.disconnect()
+        return status
+
+    # serve the rfap_* calls of other rfap-pycli processes on a unix socket over this session's warm connections,
+    # until interrupted
+    def run_daemon(self) -> int:
+        import signal
+        import socketserver
+        if (path := self.daemon_socket(create=True)) is None:
+            self.print_error("the connection daemon needs unix sockets and a directory only this user can access "
+                             "($XDG_RUNTIME_DIR or rfap-pycli-<uid> in the temp dir)")
+            self.disconnect()
+            return self.EXIT_USAGE
+        if os.path.exists(path):
+            try:
+                DaemonClient(path).rfap_disconnect()
+                self.print_error(f"a connection daemon is already listening on {path}")
+                self.disconnect()
+                return self.EXIT_USAGE
+            except OSError:
+                os.remove(path)
+        app = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                if DaemonClient.peer_uid(self.request) not in (None, os.getuid()):
+                    return
+                while True:
+                    try:
+                        message = DaemonClient.receive(self.request)
+                        name, args = message["Request"], message["Args"]
+                    except (ConnectionError, struct.error, ValueError, KeyError, TypeError):
+                        return
+                    try:
+                        if not isinstance(name, str) or not name.startswith("rfap_") or name == "rfap_disconnect":
+                            raise AttributeError(f"unsupported request '{name}'")
+                        reply = {"Result": app.request(name, *args)}
+                    except Exception as e:
+                        reply = {"Error": type(e).__name__, "Message": str(e)}
+                    DaemonClient.send(self.request, reply)
+
+        umask = os.umask(0o177)
+        try:
+            server = socketserver.ThreadingUnixStreamServer(path, Handler)
+        finally:
+            os.umask(umask)
+        server.daemon_threads = True
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        print(f"Serving {self.settings['Server']}:{self.settings['Port']} on {path}", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            os.remove(path)
+        self.disconnect()
+        return self.EXIT_OK
 
-        print(f"{self.style_fg.YELLOW}Disconnecting, please wait...{self.style.RESET_ALL}")
-        self.running = False
-        self.keep_alive_thread.join()
-        self.client.rfap_disconnect()
-        self.time_left = 60
+    def disconnect(self):
+        self.log(f"{self.style_fg.YELLOW}Disconnecting, please wait...{self.style.RESET_ALL}")
+        for job in self.jobs:
+            job.thread.join()
+        self.engine.close()
+        self.index.save()
+        if self.settings["StatsFile"] is not None:
+            with open(self.settings["StatsFile"], "w") as f:
+                json.dump(self.stats.summary(), f, indent=2)
         self.print_success("done.")
 
 # IFMAIN
 if __name__ == "__main__":
     app = RfapCliApp()
+    if app.daemon:
+        sys.exit(app.run_daemon())
+    if app.script is not None:
+        sys.exit(app.run_batch())
     app.run()
 
@@ -0,0 +1,63 @@
+# tests of the request engine against the in-process fake server from bench/fake_server.py
+
+import importlib.util
+import os
+import sys
+import threading
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+import fake_server
+
+def load_module(server: fake_server.FakeServer):
+    fake_server.install(server)
+    spec = importlib.util.spec_from_file_location("rfap_pycli", os.path.join(ROOT, "rfap-pycli.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def wait_until(condition, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+class KeepAliveTest(unittest.TestCase):
+    def setUp(self):
+        self.server = fake_server.FakeServer()
+        self.engine = load_module(self.server).Engine("localhost", 6700, 2)
+        self.engine.KEEP_ALIVE_CHECK = 0.01
+        self.engine.start()
+
+    def tearDown(self):
+        self.server.latency = 0
+        self.engine.close()
+
+    # open a second connection by holding two requests at once, then leave both idle
+    def open_two_connections(self) -> None:
+        barrier = threading.Barrier(2)
+        requests = [self.engine.submit(lambda client: barrier.wait(5)) for _ in range(2)]
+        for request in requests:
+            request.result()
+        self.assertEqual(len(self.engine.connections), 2)
+        self.assertTrue(wait_until(lambda: len(self.engine.idle) == 2))
+
+    def test_request_during_ping_keeps_keep_alive_running(self):
+        self.open_two_connections()
+        self.server.latency = 0.5
+        self.engine.KEEP_ALIVE_INTERVAL = 0
+        # the first connection is being pinged, the request takes the one the keep-alive checks next
+        self.assertTrue(wait_until(lambda: len(self.engine.idle) == 1))
+        request = self.engine.submit(lambda client: time.sleep(1))
+        requests = self.server.requests
+        request.result()
+        self.assertTrue(wait_until(lambda: self.server.requests > requests + 1))
+        self.assertFalse(self.engine.keep_alive_task.done())
+
+if __name__ == "__main__":
+    unittest.main()
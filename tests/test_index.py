@@ -0,0 +1,35 @@
+# tests of the persistent path index
+
+import os
+import tempfile
+import unittest
+
+import fake_server
+from test_engine import load_module
+
+class PathIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.module = load_module(fake_server.FakeServer())
+        self.directory = tempfile.TemporaryDirectory()
+        self.index = self.module.PathIndex({"PathIndex": True}, os.path.join(self.directory.name, "index.gz"))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_listed_subfolder_is_completed_once(self):
+        self.index.update("/d", ["f", "sub", "sub-2"])
+        self.index.update("/d/sub", ["x.txt"])
+        self.assertCountEqual(self.index.children("/d"), ["f", "sub-2", "sub/"])
+        self.index.update("/d", ["f", "sub", "sub-2"])
+        self.assertNotIn("/d/sub", self.index.load())
+        self.assertCountEqual(self.index.children("/d"), ["f", "sub-2", "sub/"])
+
+    def test_listed_folder_is_stored_as_folder(self):
+        self.index.update("/d", ["sub"])
+        self.index.add("/d/sub", True)
+        self.index.update("/d/sub", ["x.txt"])
+        self.assertEqual(self.index.load(), ["/d/sub/", "/d/sub/x.txt"])
+        self.assertEqual(self.index.children("/d"), ["sub/"])
+
+if __name__ == "__main__":
+    unittest.main()